@@ -1,11 +1,33 @@
-from scraping.historical.run import run as run_historical_scraper
-from shared.utils.utils import load_json
+import argparse
+
+from scraping.historical.run import (
+    load_leagues,
+    update_current_seasons,
+    scrape_leagues_lite,
+)
+from scraping.historical.scheduler import run_scheduler
 
 
 def main():
-    leagues_url_details = load_json('scraping/historical/urls_v2.json')
-    run_historical_scraper(leagues_url_details)
-    # print(leagues_url_details)
+    arg_parser = argparse.ArgumentParser(description="Historical stats scraper.")
+    arg_parser.add_argument(
+        "mode",
+        nargs="?",
+        default="scrape",
+        choices=["scrape", "update", "lite"],
+        help="scrape: every (league, season) not scraped yet, "
+        "update: only the new or finished fixtures of each current season, "
+        "lite: date, teams and score of every season from the season pages",
+    )
+    args = arg_parser.parse_args()
+
+    if args.mode == "update":
+        update_current_seasons(load_leagues())
+    elif args.mode == "lite":
+        scrape_leagues_lite(load_leagues())
+    else:
+        # every (league, season) of the urls_vN.json files, see scheduler_* in constants.py
+        run_scheduler()
 
 
 if __name__ == "__main__":
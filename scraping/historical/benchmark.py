@@ -0,0 +1,377 @@
+import argparse
+import gc
+import json
+import os
+import platform
+import time
+import tracemalloc
+from datetime import datetime
+from urllib.parse import urlsplit
+
+from bs4 import BeautifulSoup
+
+from scraping.historical.constants import (
+    primatips_base_url,
+    html_parser,
+    scheduler_url_files,
+    benchmark_corpus_dir,
+    benchmark_synthetic_corpus_dir,
+    benchmark_results_dir,
+    benchmark_baseline_path,
+    benchmark_fixtures_per_season,
+    benchmark_regression_tolerance,
+    benchmark_min_pass_seconds,
+)
+from scraping.historical.parser import (
+    index_sections,
+    get_section,
+    normalize_title,
+    parse_matches_stats,
+    parse_teams_stats,
+    parse_league_stats,
+    parse_odds,
+    fingerprint_layout,
+    layout_plan,
+)
+from scraping.historical.scraper import (
+    fixture_strainer,
+    get_fixtures_info,
+    parse_fixtures_info,
+    scrape_fixture,
+)
+from scraping.utils.cache import PageCache
+from scraping.utils.utils import fetch_page
+from shared.utils.utils import save_to_json, load_json
+
+# benchmarks over the season pages and over the fixture pages of the corpus
+season_benchmarks = ["parse_fixtures_info"]
+fixture_benchmarks = [
+    "soup",
+    "index_sections",
+    "parse_matches_stats",
+    "parse_teams_stats",
+    "parse_league_stats",
+    "parse_odds",
+    "scrape_fixture",
+]
+
+
+class ReplayCache:
+    # serves the recorded pages from memory, so the pipeline never reaches the network.
+    # Pages are looked up by path, the synthetic corpus lives on another host
+    revalidate = False
+
+    def __init__(self, pages):
+        self.pages = {urlsplit(url).path: content for url, content in pages.items()}
+
+    def get(self, url):
+        content = self.pages.get(urlsplit(url).path)
+        return {"content": content} if content is not None else None
+
+    def put(self, url, content, etag=None, last_modified=None):
+        pass
+
+
+def record_corpus(
+    url_files=scheduler_url_files,
+    corpus_dir=benchmark_corpus_dir,
+    fixtures_per_season=benchmark_fixtures_per_season,
+):
+    # newest and oldest season of one league per country, for a spread of layouts
+    corpus = PageCache(corpus_dir, max_bytes=1024**4)
+
+    countries = set()
+    for url_file in url_files:
+        for league in load_json(url_file):
+            if league.get("country") in countries:
+                continue
+            countries.add(league.get("country"))
+
+            for season in {league.get("seasons")[0], league.get("seasons")[-1]}:
+                season_url = f"{league.get('url')}/{season}"
+                fixtures_info = get_fixtures_info(season_url, cache=corpus)
+                for fixture in fixtures_info[:fixtures_per_season]:
+                    fetch_page(
+                        f"{primatips_base_url}{fixture.get('url')}", cache=corpus
+                    )
+
+                print(f"Recorded {season_url}")
+
+    print(f"Corpus - {corpus.stats()}")
+
+
+def load_corpus(corpus_dir=benchmark_corpus_dir):
+    corpus = PageCache(corpus_dir, max_bytes=1024**4)
+
+    season_pages = {}
+    fixture_pages = {}
+    for file_name in sorted(os.listdir(corpus_dir)):
+        if not file_name.endswith(".json"):
+            continue
+
+        with open(os.path.join(corpus_dir, file_name), "r") as meta_file:
+            url = json.load(meta_file).get("url")
+
+        page = corpus.get(url)
+        if page is None:
+            continue
+
+        if 'id="game-details-wrapper"' in page.get("content"):
+            fixture_pages[url] = page.get("content")
+        else:
+            season_pages[url] = page.get("content")
+
+    return season_pages, fixture_pages
+
+
+def prepare_fixture(content):
+    # the tables the scraper hands to each parser, found the way scrape_fixture does
+    soup = BeautifulSoup(content, html_parser, parse_only=fixture_strainer)
+    fixture_wrapper = soup.find("div", id="game-details-wrapper")
+    sections = index_sections(fixture_wrapper)
+    # parts of the page's layout, only those are benchmarked as in parse_fixture
+    plan = layout_plan(fingerprint_layout(sections))
+
+    home_team = fixture_wrapper.find(class_="team-flag-left").find("h1").text.strip()
+    away_team = fixture_wrapper.find(class_="team-flag-right").find("h1").text.strip()
+
+    matches_tables = []
+    try:
+        if "h2h" in plan:
+            h2h_table = get_section(sections, "h2h").find_next_sibling("table")
+            if h2h_table is not None:
+                matches_tables.append((h2h_table, home_team, "h2h", None))
+
+        if "prev_matches" in plan:
+            league_table = (
+                get_section(sections, "table")
+                .find_next_sibling("table", class_="standing")
+                .find("tbody")
+            )
+            league_teams = [
+                {
+                    "name": row.find("td", class_="team").text.strip().lower(),
+                    "pos": int(row.find("td", class_="position").text.strip()),
+                }
+                for row in league_table.find_all("tr")
+            ]
+            for team in (home_team, away_team):
+                pm_table = get_section(
+                    sections, ("last_games", normalize_title(team))
+                ).find_next_sibling("table", class_="games-stat")
+                matches_tables.append((pm_table, team, "prev", league_teams))
+    except Exception as e:
+        print(f"Benchmark fixture without matches tables --> {e}")
+
+    return {
+        "content": content,
+        "fixture_wrapper": fixture_wrapper,
+        "sections": sections,
+        "home_team": home_team,
+        "away_team": away_team,
+        "matches_tables": matches_tables,
+        "plan": plan,
+    }
+
+
+def fixture_benchmark(name, fixture, replay_cache):
+    if name == "soup":
+        BeautifulSoup(fixture.get("content"), html_parser, parse_only=fixture_strainer)
+    elif name == "index_sections":
+        index_sections(fixture.get("fixture_wrapper"))
+    elif name == "parse_matches_stats":
+        for table, team, matches_type, teams_list in fixture.get("matches_tables"):
+            parse_matches_stats(table, team, matches_type, teams_list=teams_list)
+    elif name == "parse_teams_stats":
+        if "teams_stats" not in fixture.get("plan"):
+            return
+        parse_teams_stats(
+            fixture.get("fixture_wrapper"),
+            fixture.get("home_team"),
+            fixture.get("away_team"),
+            sections=fixture.get("sections"),
+        )
+    elif name == "parse_league_stats":
+        if "league_stats" not in fixture.get("plan"):
+            return
+        parse_league_stats(
+            fixture.get("fixture_wrapper"), sections=fixture.get("sections")
+        )
+    elif name == "parse_odds":
+        parse_odds(fixture.get("fixture_wrapper"))
+    elif name == "scrape_fixture":
+        scrape_fixture(
+            {"url": urlsplit(fixture.get("url")).path, "round": 1},
+            cache=replay_cache,
+        )
+
+
+def best_pass(run_pass, repeats, min_seconds=benchmark_min_pass_seconds):
+    # a small corpus is run several times per pass so timer noise doesn't decide
+    # the result, the fastest pass is the least disturbed by the rest of the machine
+    timings = []
+    for _ in range(repeats):
+        gc.collect()
+        runs = 0
+        started = time.perf_counter()
+        while True:
+            run_pass()
+            runs += 1
+            elapsed = time.perf_counter() - started
+            if elapsed >= min_seconds:
+                break
+        timings.append(elapsed / runs)
+
+    return min(timings)
+
+
+def run_benchmarks(corpus_dir=benchmark_corpus_dir, repeats=5):
+    season_pages, fixture_pages = load_corpus(corpus_dir)
+    if not fixture_pages:
+        raise ValueError(
+            f"No recorded fixture pages in '{corpus_dir}', record them with --record "
+            "or check the harness with --synthetic"
+        )
+
+    corpus_urls = [*season_pages, *fixture_pages]
+    replay_cache = ReplayCache({**season_pages, **fixture_pages})
+    fixtures = []
+    for url, content in fixture_pages.items():
+        fixture = prepare_fixture(content)
+        fixture["url"] = url
+        fixtures.append(fixture)
+
+    results = {}
+    for name in season_benchmarks:
+        seconds = best_pass(
+            lambda: [parse_fixtures_info(page) for page in season_pages.values()],
+            repeats,
+        )
+        results[name] = {"items": len(season_pages), "seconds": seconds}
+
+    for name in fixture_benchmarks:
+        seconds = best_pass(
+            lambda: [
+                fixture_benchmark(name, fixture, replay_cache) for fixture in fixtures
+            ],
+            repeats,
+        )
+        results[name] = {"items": len(fixtures), "seconds": seconds}
+
+    for stats in results.values():
+        stats["ms_per_item"] = round(
+            stats["seconds"] * 1000 / max(stats["items"], 1), 3
+        )
+        stats["items_per_second"] = (
+            round(stats["items"] / stats["seconds"], 2) if stats["seconds"] else None
+        )
+        stats["seconds"] = round(stats["seconds"], 4)
+
+    # peak memory of one full pipeline pass, measured apart since tracing slows it down
+    gc.collect()
+    tracemalloc.start()
+    for fixture in fixtures:
+        fixture_benchmark("scrape_fixture", fixture, replay_cache)
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # pages that were not recorded from the site, e.g. the synthetic corpus
+    synthetic = any(
+        urlsplit(url).netloc != urlsplit(primatips_base_url).netloc
+        for url in corpus_urls
+    )
+
+    return {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "corpus": corpus_dir,
+        "synthetic": synthetic,
+        "python": platform.python_version(),
+        "html_parser": html_parser,
+        "season_pages": len(season_pages),
+        "fixture_pages": len(fixtures),
+        "fixtures_per_second": results.get("scrape_fixture").get("items_per_second"),
+        "peak_memory_mb": round(peak_bytes / 1024**2, 2),
+        "benchmarks": results,
+    }
+
+
+def compare_to_baseline(
+    report,
+    baseline_path=benchmark_baseline_path,
+    tolerance=benchmark_regression_tolerance,
+):
+    try:
+        baseline = load_json(baseline_path)
+    except FileNotFoundError:
+        print(f"No baseline at '{baseline_path}', nothing to compare against.")
+        return []
+
+    regressions = []
+    for name, stats in report.get("benchmarks").items():
+        baseline_stats = baseline.get("benchmarks", {}).get(name)
+        if not baseline_stats or not baseline_stats.get("ms_per_item"):
+            continue
+
+        ratio = stats.get("ms_per_item") / baseline_stats.get("ms_per_item")
+        flag = "REGRESSION" if ratio > 1 + tolerance else ""
+        print(
+            f"{name:<22} {baseline_stats.get('ms_per_item'):>10.3f} ms "
+            f"-> {stats.get('ms_per_item'):>10.3f} ms  x{ratio:.2f} {flag}"
+        )
+        if flag:
+            regressions.append(name)
+
+    return regressions
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        description="Offline benchmark of the fixture parsers over recorded pages."
+    )
+    arg_parser.add_argument("--record", action="store_true", help="record the corpus")
+    arg_parser.add_argument("--corpus", default=benchmark_corpus_dir)
+    arg_parser.add_argument(
+        "--synthetic",
+        action="store_true",
+        help="run over the synthetic corpus, only checks that the harness works",
+    )
+    arg_parser.add_argument("--repeats", type=int, default=5)
+    arg_parser.add_argument(
+        "--save-baseline", action="store_true", help="store this run as the baseline"
+    )
+    args = arg_parser.parse_args()
+
+    if args.record:
+        record_corpus(corpus_dir=args.corpus)
+
+    corpus_dir = benchmark_synthetic_corpus_dir if args.synthetic else args.corpus
+
+    report = run_benchmarks(corpus_dir=corpus_dir, repeats=args.repeats)
+    print(
+        f"{report.get('fixture_pages')} fixtures, "
+        f"{report.get('fixtures_per_second')} fixtures/sec, "
+        f"peak memory {report.get('peak_memory_mb')} MB"
+    )
+
+    os.makedirs(benchmark_results_dir, exist_ok=True)
+    save_to_json(
+        f"{benchmark_results_dir}/{datetime.now().strftime('%Y%m%d-%H%M%S')}.json",
+        report,
+    )
+
+    if report.get("synthetic"):
+        # toy pages say nothing about the speed on real ones
+        print("Synthetic corpus, not compared with or saved as the baseline.")
+        return 0
+
+    regressions = compare_to_baseline(report)
+    if args.save_baseline:
+        save_to_json(benchmark_baseline_path, report)
+        print(f"Baseline saved to '{benchmark_baseline_path}'.")
+
+    # non-zero exit status, so a regression fails a CI step
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,5 +1,67 @@
 primatips_base_url = "https://primatips.com"
 
+# BeautifulSoup tree builder, "html.parser" is the slower pure-Python fallback
+html_parser = "lxml"
+
+# other spellings of a team across seasons -> the name used in the league tables
+team_aliases = {}
+
+# concurrent fixture fetching
+scraper_max_workers = 4
+# processes parsing the downloaded pages, 0 parses on the download threads
+scraper_parse_processes = 2
+host_request_interval = 0.25  # min seconds between two requests to the same host
+
+# adaptive limiter, the rate halves on 429/503 and recovers on every success
+host_request_burst = 2
+host_min_request_rate = 0.2  # requests per second
+circuit_breaker_threshold = 5  # consecutive failures before every worker pauses
+circuit_breaker_cooldown = 60  # seconds, doubled while the host keeps failing
+
+# on-disk cache of raw fixture pages
+use_page_cache = True
+page_cache_dir = "scraping/historical/.page_cache"
+page_cache_max_bytes = 1024**3
+page_cache_revalidate = False
+
+# per-season files of already parsed fixtures, committed with the data so a run can resume
+checkpoint_dir = "scraping/historical/checkpoints"
+
+# url, round, teams and status of every fixture in a season csv, used by update_season
+fixture_index_dir = "scraping/historical/fixture_index"
+
+# per-run timing summaries, and profiler output when FORM_ANALYSIS_PROFILE is set
+timing_dir = "scraping/historical/timing"
+
+# offline parser benchmark, the corpus is a page cache of season / fixture pages
+# recorded from the site with --record. The synthetic corpus is hand-written pages
+# with the site's markup, it checks the harness runs but its timings are no baseline
+benchmark_corpus_dir = "scraping/historical/benchmarks/corpus"
+benchmark_synthetic_corpus_dir = "scraping/historical/benchmarks/synthetic"
+benchmark_results_dir = "scraping/historical/benchmarks/results"
+benchmark_baseline_path = "scraping/historical/benchmarks/baseline.json"
+benchmark_fixtures_per_season = 10
+benchmark_regression_tolerance = 0.1  # slower than the baseline by more than 10%
+benchmark_min_pass_seconds = 0.2  # each timed pass runs the corpus this long
+
+# season csv rows are flushed to disk every N fixtures
+csv_flush_every = 20
+
+# (league, season) work queue
+scheduler_url_files = [
+    "scraping/historical/urls_v1.json",
+    "scraping/historical/urls_v2.json",
+    "scraping/historical/urls_v3.json",
+]
+scheduler_jobs_path = "scraping/historical/jobs.json"
+# seasons scraped at once, they split host_request_interval between them
+scheduler_max_processes = 3
+scheduler_time_budget = 25 * 60  # seconds, no new season starts if it would overrun
+# assumed length of a season until one has finished, seasons left running stop
+# taking new fixtures once the budget is spent and resume from their checkpoint
+scheduler_default_season_duration = 8 * 60
+scheduler_max_attempts = 3
+
 seasons_v1 = [
     "2012-2013",
     "2013-2014",
@@ -104,3 +166,7 @@ field_names = [
     "gg_yes_prima_prob",
     "gg_no_prima_prob",
 ]
+
+# lite season files, one row per fixture link of the season page; rows enriched by a
+# full fixture scrape fill the field_names columns too
+lite_field_names = field_names + ["hg_ft", "ag_ft", "url"]
@@ -1,10 +1,85 @@
 from datetime import datetime
-from io import StringIO
 
-import pandas as pd
+import hashlib
 import re
+from functools import lru_cache
 from bs4 import BeautifulSoup
 
+from shared.utils.timing import count, timed
+
+
+non_digits = re.compile(r"[^0-9]")
+# same whitespace clean-up pandas.read_html applied to cells
+cell_whitespace = re.compile(r"[\r\n]+|\s{2,}")
+
+# field -> caption of its row in the "Overall Statistics" table and its type
+league_stats_spec = {
+    "lw_hw": ("Home Win", int),
+    "lg_draws": ("Draw", int),
+    "lg_aw": ("Away Win", int),
+    "lg_avg_goals": ("Goals per Game", float),
+    "lg_gsr_1": ("Home Goals per Game", float),
+    "lg_gsr_2": ("Away Goals per Game", float),
+    "lg_gsf_1": ("Home Team Scored in", int),
+    "lg_gsf_2": ("Away Team Scored in", int),
+    "lg_gg": ("Both Teams to Score", int),
+    "lg_015": ("Over 1.5", int),
+    "lg_025": ("Over 2.5", int),
+    "lg_035": ("Over 3.5", int),
+}
+
+# row of an odds table holding the odds / the probabilities, and their type
+odds_rows = {"odd": (0, float), "prob": (1, int)}
+
+# field -> (odds table title, row, value index); draw_odds and gg_no_prima_prob
+# point where the values in the existing season files came from
+odds_spec = {
+    "hw_odds": ("Standard 1X2", "odd", 0),
+    "draw_odds": ("Standard 1X2", "odd", -1),
+    "aw_odds": ("Standard 1X2", "odd", -1),
+    "1x_odds": ("Double Chance", "odd", 0),
+    "x2_odds": ("Double Chance", "odd", -1),
+    "o15_odds": ("Over/Under 1.5", "odd", 0),
+    "u15_odds": ("Over/Under 1.5", "odd", -1),
+    "o25_odds": ("Over/Under 2.5", "odd", 0),
+    "u25_odds": ("Over/Under 2.5", "odd", -1),
+    "o35_odds": ("Over/Under 3.5", "odd", 0),
+    "u35_odds": ("Over/Under 3.5", "odd", -1),
+    "gg_yes_odds": ("Both Teams to Score", "odd", 0),
+    "gg_no_odds": ("Both Teams to Score", "odd", -1),
+    "hw_prima_prob": ("Standard 1X2", "prob", 0),
+    "draw_prima_prob": ("Standard 1X2", "prob", 1),
+    "aw_prima_prob": ("Standard 1X2", "prob", -1),
+    "1x_prima_prob": ("Double Chance", "prob", 0),
+    "x2_prima_prob": ("Double Chance", "prob", -1),
+    "o15_prima_prob": ("Over/Under 1.5", "prob", 0),
+    "u15_prima_prob": ("Over/Under 1.5", "prob", -1),
+    "o25_prima_prob": ("Over/Under 2.5", "prob", 0),
+    "u25_prima_prob": ("Over/Under 2.5", "prob", -1),
+    "o35_prima_prob": ("Over/Under 3.5", "prob", 0),
+    "u35_prima_prob": ("Over/Under 3.5", "prob", -1),
+    "gg_yes_prima_prob": ("Both Teams to Score", "prob", 0),
+    "gg_no_prima_prob": ("Both Teams to Score", "odd", -1),
+}
+
+
+# pieces of a fixture link on the season page: date, kickoff, score, team names
+index_date_formats = ["%d.%m.%Y", "%Y-%m-%d", "%d.%m.%y", "%d/%m/%Y"]
+index_kickoff = re.compile(r"^\d{1,2}:\d{2}$")
+index_score = re.compile(r"^(\d+)\s*[-:]\s*(\d+)$")
+
+
+def compile_spec(spec):
+    # lower-cased title / caption -> the spec entries read from it
+    plan = {}
+    for field, (title, *rest) in spec.items():
+        plan.setdefault(title.lower(), []).append((field, *rest))
+    return plan
+
+
+league_stats_plan = compile_spec(league_stats_spec)
+odds_plan = compile_spec(odds_spec)
+
 
 # HELPER FUNCTIONS
 def extract_stats_from_scores(scores_list, team, tp):
@@ -43,11 +118,57 @@ def extract_stats_from_scores(scores_list, team, tp):
     return stats
 
 
+def normalize_team(team_name):
+    return team_name.strip().lower()
+
+
+def stable_team_id(team_key):
+    # derived from the normalized name alone, so the same in every run, season and
+    # parse process without a shared table (48 bits, safe as a JSON / JS number)
+    digest = hashlib.blake2b(team_key.encode(), digest_size=6).digest()
+    return int.from_bytes(digest, "big")
+
+
+class TeamRegistry:
+    # league table of one fixture, indexed by normalized name with aliases resolved
+    def __init__(self, league_teams=(), aliases=None):
+        self.aliases = {
+            normalize_team(alias): normalize_team(name)
+            for alias, name in (aliases or {}).items()
+        }
+        self.teams = {}
+        for team in league_teams:
+            # the first row wins when a name is listed twice, like the list scans did
+            key = self.resolve(team.get("name"))
+            self.teams.setdefault(
+                key, {"id": stable_team_id(key), "pos": team.get("pos")}
+            )
+
+    def resolve(self, team_name):
+        key = normalize_team(team_name)
+        return self.aliases.get(key, key)
+
+    def __contains__(self, team_name):
+        return self.resolve(team_name) in self.teams
+
+    def position(self, team_name):
+        team = self.teams.get(self.resolve(team_name))
+        return team.get("pos") if team else None
+
+    def team_id(self, team_name):
+        # aliases share the id of the name they resolve to
+        return stable_team_id(self.resolve(team_name))
+
+
 def is_team_in_the_league(team_name, league_teams):
+    if isinstance(league_teams, TeamRegistry):
+        return team_name in league_teams
     return any(d.get("name") == team_name for d in league_teams)
 
 
 def get_team_pos(team_name, league_teams):
+    if isinstance(league_teams, TeamRegistry):
+        return league_teams.position(team_name)
     for d in league_teams:
         if d.get("name").lower() == team_name.lower():
             return d.get("pos")
@@ -58,11 +179,141 @@ def get_goals(scores_str_list):
     scores = [score.split("-") for score in scores_str_list if score != "-"]
     int_goals = []
     for score in scores:
-        goals = [int(re.sub(r'[^0-9]', '', s)) for s in score]
+        goals = [int(non_digits.sub("", s)) for s in score]
         int_goals.append(goals)
     return int_goals
 
 
+def cell_text(cell):
+    return cell_whitespace.sub(" ", cell.text).strip()
+
+
+def expand_row(row):
+    cells = []
+    for cell in row.find_all(["th", "td"], recursive=False):
+        cells.extend([cell_text(cell)] * int(cell.get("colspan", 1) or 1))
+    return cells
+
+
+def extract_table_columns(table):
+    # header text -> non empty cell texts of that column
+    thead = table.find("thead")
+    header_row = thead.find("tr") if thead else table.find("tr")
+    header = expand_row(header_row)
+
+    tbody = table.find("tbody")
+    rows = tbody.find_all("tr") if tbody else header_row.find_next_siblings("tr")
+
+    body = [expand_row(row) for row in rows]
+
+    columns = {}
+    for index, title in enumerate(header):
+        # duplicated headers keep the first column, as pandas did
+        if title in columns:
+            continue
+
+        columns[title] = [
+            cells[index] for cells in body if index < len(cells) and cells[index] != ""
+        ]
+
+    return columns
+
+
+# section keys and the text their "h2.games-title" heading contains
+section_titles = {
+    "h2h": "H2H last",
+    "table": "Table",
+    "home_away": "Home/Away Matches",
+    "league_position": "League Position",
+    "league_form": "League Form",
+    "league_goals": "League Goals",
+    "league_overall": "Overall Statistics for",
+}
+last_games_title = re.compile(r"^(.*?)\s+last \d+ games$")
+
+
+# sections each part of a fixture row is parsed from
+layout_requirements = {
+    "h2h": ("h2h",),
+    "prev_matches": ("table", "last_games"),
+    "teams_stats": ("league_position", "league_form", "league_goals"),
+    "league_stats": ("league_overall",),
+}
+
+
+def fingerprint_layout(sections):
+    # the section headings a fixture page has, e.g. "h2h+last_games+table+..."
+    present = {key if isinstance(key, str) else key[0] for key in sections}
+    return "+".join(sorted(present)) or "empty"
+
+
+@lru_cache(maxsize=None)
+def layout_plan(layout):
+    # parts of the row a layout can fill, worked out once per distinct layout
+    present = set(layout.split("+"))
+    return frozenset(
+        part
+        for part, required in layout_requirements.items()
+        if present.issuperset(required)
+    )
+
+
+def record_layout(layout, part, outcome):
+    # per layout page counts and parse outcomes, exported with the timing summary
+    count(f"layout {layout} {part} {outcome}")
+
+
+def layout_success_rates(counters):
+    # {layout: {"pages": n, part: share of the pages it parsed on}} from the counters
+    rates = {}
+    for name, value in counters.items():
+        if not name.startswith("layout "):
+            continue
+        layout, part, outcome = name[len("layout ") :].rsplit(" ", 2)
+        rates.setdefault(layout, {}).setdefault(part, {})[outcome] = value
+
+    for layout, parts in rates.items():
+        pages = parts.pop("pages", {}).get("seen", 0)
+        for part, outcomes in parts.items():
+            attempts = outcomes.get("ok", 0) + outcomes.get("failed", 0)
+            parts[part] = round(outcomes.get("ok", 0) / attempts, 3) if attempts else None
+        if pages:
+            parts["pages"] = pages
+
+    return rates
+
+
+def normalize_title(text):
+    return " ".join(text.split()).lower()
+
+
+@timed("index_sections")
+def index_sections(fixture_wrapper):
+    # walk the section headings once, first match wins like select_one did
+    sections = {}
+    for heading in fixture_wrapper.find_all("h2", class_="games-title"):
+        title = " ".join(heading.get_text().split())
+
+        for key, title_text in section_titles.items():
+            if key not in sections and title_text in title:
+                sections[key] = heading
+
+        # "<team> last 12 games", keyed by team so quotes in names don't matter
+        last_games = last_games_title.match(title)
+        if last_games:
+            team_key = ("last_games", normalize_title(last_games.group(1)))
+            sections.setdefault(team_key, heading)
+
+    return sections
+
+
+def get_section(sections, key):
+    heading = sections.get(key)
+    if heading is None:
+        raise ValueError(f"section {key} not found")
+    return heading
+
+
 def smart_avg(value, frequency):
     if frequency < 1:
         return 0
@@ -70,9 +321,67 @@ def smart_avg(value, frequency):
 
 
 # PARSERS
+def parse_index_date(text):
+    # "12.08.2023" or "12.08.2023 15:30"
+    date_text, _, kickoff = text.partition(" ")
+    if kickoff and not index_kickoff.match(kickoff.strip()):
+        return None
+
+    for date_format in index_date_formats:
+        try:
+            return datetime.strptime(date_text, date_format).date()
+        except ValueError:
+            continue
+    return None
+
+
+def parse_index_fixture(fixture_link):
+    # date, teams and full-time score of a fixture link on the season page, the
+    # team before the score is the home team; None when the link can't be read
+    fixture = {"date": None, "home_team": None, "away_team": None}
+    home_goals = away_goals = None
+    teams = []
+
+    for text in fixture_link.get_text(separator="|", strip=True).split("|"):
+        text = text.strip()
+        date = parse_index_date(text) if fixture.get("date") is None else None
+        score = index_score.match(text)
+
+        if date is not None:
+            fixture["date"] = date
+        elif index_kickoff.match(text):
+            continue
+        elif score and home_goals is None:
+            home_goals, away_goals = int(score.group(1)), int(score.group(2))
+        elif text and text not in ("-", "?", ":"):
+            teams.append(text)
+
+    if len(teams) != 2 or fixture.get("date") is None:
+        return None
+
+    fixture["home_team"], fixture["away_team"] = teams
+    fixture["hg_ft"] = home_goals
+    fixture["ag_ft"] = away_goals
+    fixture["ft_res"] = None
+    if home_goals is not None:
+        if home_goals > away_goals:
+            fixture["ft_res"] = "H"
+        elif home_goals == away_goals:
+            fixture["ft_res"] = "D"
+        else:
+            fixture["ft_res"] = "A"
+
+    return fixture
+
+
+@timed("parse_matches_stats")
 def parse_matches_stats(matches_table, home_team, matches_type, teams_list=None) -> []:
     stats = []
 
+    if matches_type == "prev" and not isinstance(teams_list, TeamRegistry):
+        # one hash lookup per row instead of scanning the league table
+        teams_list = TeamRegistry(teams_list)
+
     matches = matches_table.find("tbody").find_all("tr")
 
     for match in matches:
@@ -84,7 +393,7 @@ def parse_matches_stats(matches_table, home_team, matches_type, teams_list=None)
         away = match.find(class_="ateam").text.strip().lower()
 
         result = match.find(class_="result").text.strip().split("-")
-        result = [int(re.sub(r'[^0-9]', '', score)) for score in result]
+        result = [int(non_digits.sub("", score)) for score in result]
 
         if home.lower() == home_team.lower():
             gf = result[0]
@@ -133,19 +442,24 @@ def parse_matches_stats(matches_table, home_team, matches_type, teams_list=None)
     return stats
 
 
-def parse_teams_stats(fixture_wrapper: BeautifulSoup, home_team: str, away_team: str):
+@timed("parse_teams_stats")
+def parse_teams_stats(
+    fixture_wrapper: BeautifulSoup, home_team: str, away_team: str, sections=None
+):
+    if sections is None:
+        sections = index_sections(fixture_wrapper)
 
     # paser home / away stats from home / away table using scores
     try:
-        home_away_stats_table = fixture_wrapper.select_one(
-            "h2.games-title:-soup-contains('Home/Away Matches')"
-        ).find_next_sibling("table", class_="lgames")
-        home_away_stats_df = pd.read_html(StringIO(str(home_away_stats_table)))[0]
+        home_away_stats_table = get_section(sections, "home_away").find_next_sibling(
+            "table", class_="lgames"
+        )
+        home_away_stats_columns = extract_table_columns(home_away_stats_table)
 
-        home_scores = home_away_stats_df[home_team].dropna().tolist()
+        home_scores = home_away_stats_columns[home_team]
         home_goals = get_goals(home_scores)
 
-        away_scores = home_away_stats_df[away_team].dropna().tolist()
+        away_scores = home_away_stats_columns[away_team]
         away_goals = get_goals(away_scores)
 
         # todos.py: extract / deduce stats from the goals
@@ -172,27 +486,27 @@ def parse_teams_stats(fixture_wrapper: BeautifulSoup, home_team: str, away_team:
 
     # teams points and positions
     teams_pos_and_points = (
-        fixture_wrapper.select_one("h2.games-title:-soup-contains('League Position')")
+        get_section(sections, "league_position")
         .find_next_sibling("table", class_="perf")
         .find_all("tr")
     )
     overall_positions = [
-        int(re.sub(r'[^0-9]', '', s.text.strip())) for s in teams_pos_and_points[1].find_all(class_="pos")
+        int(non_digits.sub("", s.text.strip())) for s in teams_pos_and_points[1].find_all(class_="pos")
     ]
     home_away_positions = [
-        int(re.sub(r'[^0-9]', '', s.text.strip())) for s in teams_pos_and_points[4].find_all(class_="pos")
+        int(non_digits.sub("", s.text.strip())) for s in teams_pos_and_points[4].find_all(class_="pos")
     ]
 
     overall_points = [
-        int(re.sub(r'[^0-9]', '', s.text.strip())) for s in teams_pos_and_points[2].find_all(class_="pos")
+        int(non_digits.sub("", s.text.strip())) for s in teams_pos_and_points[2].find_all(class_="pos")
     ]
     home_away_points = [
-        int(re.sub(r'[^0-9]', '', s.text.strip())) for s in teams_pos_and_points[5].find_all(class_="pos")
+        int(non_digits.sub("", s.text.strip())) for s in teams_pos_and_points[5].find_all(class_="pos")
     ]
 
     # form stats
     teams_form_stats = (
-        fixture_wrapper.select_one("h2.games-title:-soup-contains('League Form')")
+        get_section(sections, "league_form")
         .find_next_sibling("table", class_="perf")
         .find_all("tr")
     )
@@ -209,7 +523,7 @@ def parse_teams_stats(fixture_wrapper: BeautifulSoup, home_team: str, away_team:
             .split("|")
         )
         form_stats = [
-            int(re.sub(r'[^0-9]', '', s)) for s in form_stats if s != "" and s != "\xa0" and s != " "
+            int(non_digits.sub("", s)) for s in form_stats if s != "" and s != "\xa0" and s != " "
         ]
 
         return form_stats
@@ -227,7 +541,7 @@ def parse_teams_stats(fixture_wrapper: BeautifulSoup, home_team: str, away_team:
 
     # teams stats table
     teams_goals_stats = (
-        fixture_wrapper.select_one("h2.games-title:-soup-contains('League Goals')")
+        get_section(sections, "league_goals")
         .find_next_sibling("table", class_="perf")
         .find_all("tr")
     )
@@ -271,119 +585,73 @@ def parse_teams_stats(fixture_wrapper: BeautifulSoup, home_team: str, away_team:
     return teams_stats
 
 
-def parse_league_stats(fixture_wrapper):
+@timed("parse_league_stats")
+def parse_league_stats(fixture_wrapper, sections=None):
+    if sections is None:
+        sections = index_sections(fixture_wrapper)
+
     league_stats_rows = (
-        fixture_wrapper.select_one(
-            "h2.games-title:-soup-contains('Overall Statistics for')"
-        )
+        get_section(sections, "league_overall")
         .find_next_sibling("table", class_="lperf")
         .find("tbody")
         .find_all("tr")
     )
 
-    def get_league_stat(caption, fl=False):
-        for row in league_stats_rows:
-            label = None
-            try:
-                label = row.find(class_="label").text.strip().lower()
-            except Exception as e:
-                continue
-
-            if label == caption.lower():
-                if fl:
-                    return float(row.find(class_="data").text.strip().replace("%", ""))
-                return int(row.find(class_="data").text.strip().replace("%", ""))
+    # one pass over the rows, the first row with a caption is the one used
+    league_stats_data = {}
+    for row in league_stats_rows:
+        try:
+            label = row.find(class_="label").text.strip().lower()
+        except Exception as e:
+            continue
+
+        if label in league_stats_plan and label not in league_stats_data:
+            league_stats_data[label] = (
+                row.find(class_="data").text.strip().replace("%", "")
+            )
 
     league_stats = {
-        "lg_mp": int(league_stats_rows[0].text.strip().split("(")[-1].replace(")", "")),
-        "lw_hw": get_league_stat("Home Win"),
-        "lg_draws": get_league_stat("Draw"),
-        "lg_aw": get_league_stat("Away Win"),
-        "lg_avg_goals": get_league_stat("Goals per Game", fl=True),
-        "lg_gsr_1": get_league_stat("Home Goals per Game", fl=True),
-        "lg_gsr_2": get_league_stat("Away Goals per Game", fl=True),
-        "lg_gsf_1": get_league_stat("Home Team Scored in"),
-        "lg_gsf_2": get_league_stat("Away Team Scored in"),
-        "lg_gg": get_league_stat("Both Teams to Score"),
-        "lg_015": get_league_stat("Over 1.5"),
-        "lg_025": get_league_stat("Over 2.5"),
-        "lg_035": get_league_stat("Over 3.5"),
+        "lg_mp": int(league_stats_rows[0].text.strip().split("(")[-1].replace(")", ""))
     }
+    for field, (caption, convert) in league_stats_spec.items():
+        data = league_stats_data.get(caption.lower())
+        league_stats[field] = convert(data) if data is not None else None
 
     return league_stats
 
 
+@timed("parse_odds")
 def parse_odds(fixture_wrapper):
     # odds_tables = (
     #     fixture_wrapper.select_one("h2.games-title:-soup-contains('Coefficients and Probabilities')")
     #     .find_parent(class_='games-stat-wrapper').find_all('table', class_='odds')
     # )
 
-    odds_tables = fixture_wrapper.find_all("table", class_="odds")
-
-    def get_odd(odd_name, type="odd"):
-        row_index = 0 if type == "odd" else 1
-        for table in odds_tables:
-            odd_type = table.find("thead").find(class_="odds-type").text.strip()
-            if odd_name.lower() == odd_type.lower():
-                try:
-                    odds = (
-                        table.find("tbody")
-                        .find_all("tr")[row_index]
-                        .find_all("td", class_="odd")
-                    )
-                    odds = [odd.text.strip().replace("%", "") for odd in odds]
-
-                    if type == "odd":
-                        odds = [float(odd) for odd in odds if odd != ""]
-                    else:
-                        odds = [int(odd) for odd in odds if odd != ""]
-
-                    return odds
-                except:
-                    pass
-
-    wdl_odds = get_odd("Standard 1X2") or [None, None]
-    dc_odds = get_odd("Double Chance") or [None, None]
-    o15_odds = get_odd("Over/Under 1.5") or [None, None]
-    o25_odds = get_odd("Over/Under 2.5") or [None, None]
-    o35_odds = get_odd("Over/Under 3.5") or [None, None]
-    gg_odds = get_odd("Both Teams to Score") or [None, None]
-
-    wdl_prob = get_odd("Standard 1X2", "prob") or [None, None]
-    dc_prob = get_odd("Double Chance", "prob") or [None, None]
-    o15_prob = get_odd("Over/Under 1.5", "prob") or [None, None]
-    o25_prob = get_odd("Over/Under 2.5", "prob") or [None, None]
-    o35_prob = get_odd("Over/Under 3.5", "prob") or [None, None]
-    gg_prob = get_odd("Both Teams to Score", "prob") or [None, None]
-
-    odds_stats = {
-        "hw_odds": wdl_odds[0],
-        "draw_odds": wdl_odds[-1],
-        "aw_odds": wdl_odds[-1],
-        "1x_odds": dc_odds[0],
-        "x2_odds": dc_odds[-1],
-        "o15_odds": o15_odds[0],
-        "u15_odds": o15_odds[-1],
-        "o25_odds": o25_odds[0],
-        "u25_odds": o25_odds[-1],
-        "o35_odds": o35_odds[0],
-        "u35_odds": o35_odds[-1],
-        "gg_yes_odds": gg_odds[0],
-        "gg_no_odds": gg_odds[-1],
-        "hw_prima_prob": wdl_prob[0],
-        "draw_prima_prob": wdl_prob[1],
-        "aw_prima_prob": wdl_prob[-1],
-        "1x_prima_prob": dc_prob[0],
-        "x2_prima_prob": dc_prob[-1],
-        "o15_prima_prob": o15_prob[0],
-        "u15_prima_prob": o15_prob[-1],
-        "o25_prima_prob": o25_prob[0],
-        "u25_prima_prob": o25_prob[-1],
-        "o35_prima_prob": o35_prob[0],
-        "u35_prima_prob": o35_prob[-1],
-        "gg_yes_prima_prob": gg_prob[0],
-        "gg_no_prima_prob": gg_odds[-1],
-    }
+    # every odds table is visited once, the first one that parses wins per row
+    odds_values = {}
+    for table in fixture_wrapper.find_all("table", class_="odds"):
+        odd_type = table.find("thead").find(class_="odds-type").text.strip().lower()
+        if odd_type not in odds_plan:
+            continue
+
+        rows = None
+        for row_type, (row_index, convert) in odds_rows.items():
+            if (odd_type, row_type) in odds_values:
+                continue
+            try:
+                if rows is None:
+                    rows = table.find("tbody").find_all("tr")
+                odds = rows[row_index].find_all("td", class_="odd")
+                odds = [odd.text.strip().replace("%", "") for odd in odds]
+                odds_values[(odd_type, row_type)] = [
+                    convert(odd) for odd in odds if odd != ""
+                ]
+            except:
+                pass
+
+    odds_stats = {}
+    for field, (odd_name, row_type, index) in odds_spec.items():
+        odds = odds_values.get((odd_name.lower(), row_type)) or [None, None]
+        odds_stats[field] = odds[index]
 
     return odds_stats
@@ -1,8 +1,356 @@
+import csv
 import os
+from datetime import date, datetime
 
-from scraping.historical.constants import field_names
-from scraping.historical.scraper import scraper
-from shared.utils.utils import save_to_json, convert_to_csv, load_json
+from scraping.historical.constants import (
+    field_names,
+    lite_field_names,
+    scraper_max_workers,
+    scraper_parse_processes,
+    host_request_interval,
+    host_request_burst,
+    host_min_request_rate,
+    circuit_breaker_threshold,
+    circuit_breaker_cooldown,
+    use_page_cache,
+    page_cache_dir,
+    page_cache_max_bytes,
+    page_cache_revalidate,
+    checkpoint_dir,
+    fixture_index_dir,
+    timing_dir,
+    csv_flush_every,
+    scheduler_url_files,
+)
+from scraping.historical.parser import layout_success_rates
+from scraping.historical.scraper import get_fixtures_info, iter_scraped_fixtures
+from scraping.utils.cache import PageCache
+from scraping.utils.checkpoint import FixtureCheckpoint
+from scraping.utils.throttle import configure_throttle, throttle_stats
+from scraping.utils.utils import get_session, close_session, connection_stats
+from shared.utils.timing import save_timing_summary, timing_summary
+from shared.utils.utils import save_to_json, write_csv_stream, load_json
+
+
+def season_file_path(country, league_name, season):
+    return f"./shared/data/historical/{country}/{country}_{league_name}_{season}.csv"
+
+
+def lite_season_file_path(country, league_name, season):
+    return f"./shared/data/lite/{country}/{country}_{league_name}_{season}.csv"
+
+
+def season_checkpoint_path(country, league_name, season):
+    return f"{checkpoint_dir}/{country}_{league_name}_{season}.jsonl"
+
+
+def season_index_path(country, league_name, season):
+    return f"{fixture_index_dir}/{country}_{league_name}_{season}.json"
+
+
+def load_season_index(country, league_name, season):
+    try:
+        return load_json(season_index_path(country, league_name, season))
+    except FileNotFoundError:
+        return None
+
+
+def load_leagues(url_files=scheduler_url_files):
+    # every league of the urls_vN.json files, once even if listed in several
+    leagues = {}
+    for url_file in url_files:
+        for league in load_json(url_file):
+            leagues.setdefault(
+                (league.get("country"), league.get("league_name")), league
+            )
+
+    return list(leagues.values())
+
+
+def index_fixtures(scraped_fixtures, fixture_index):
+    # records which csv row came from which fixture url while the rows stream past
+    for fixture, stats in scraped_fixtures:
+        fixture_index[fixture.get("url")] = {
+            "round": fixture.get("round"),
+            "home_team": stats.get("home_team"),
+            "away_team": stats.get("away_team"),
+            "date": str(stats.get("date")) if stats.get("date") else None,
+            "finished": bool(stats.get("ft_res")),
+        }
+        yield stats
+
+
+def timing_summary_path(name):
+    return f"{timing_dir}/{name}_{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+
+
+def make_page_cache():
+    if not use_page_cache:
+        return None
+
+    return PageCache(
+        page_cache_dir,
+        max_bytes=page_cache_max_bytes,
+        revalidate=page_cache_revalidate,
+    )
+
+
+def setup_throttle(processes=1):
+    # worker processes share the host's request rate
+    configure_throttle(
+        burst=host_request_burst,
+        rate_share=1 / processes,
+        min_rate=host_min_request_rate / processes,
+        failure_threshold=circuit_breaker_threshold,
+        cooldown=circuit_breaker_cooldown,
+    )
+
+
+def scrape_season(
+    base_url, country, league_name, season, page_cache=None, deadline=None
+):
+    url = f"{base_url}/{season}"
+    print(url)
+
+    # parsed fixtures survive a crash and are skipped on the next attempt
+    checkpoint = FixtureCheckpoint(season_checkpoint_path(country, league_name, season))
+
+    file_path = season_file_path(country, league_name, season)
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+
+    # rows go to disk as they are parsed instead of after the whole season
+    fixtures_info = get_fixtures_info(url, request_delay=host_request_interval)
+    scraped_fixtures = iter_scraped_fixtures(
+        fixtures_info,
+        max_workers=scraper_max_workers,
+        request_delay=host_request_interval,
+        cache=page_cache,
+        checkpoint=checkpoint,
+        parse_processes=scraper_parse_processes,
+        deadline=deadline,
+    )
+
+    # out of time, the csv is left unfinished and the checkpoint kept for the next run
+    fixture_index = {}
+    rows_written = write_csv_stream(
+        index_fixtures(scraped_fixtures, fixture_index),
+        file_path,
+        field_names,
+        flush_every=csv_flush_every,
+    )
+
+    if rows_written:
+        os.makedirs(fixture_index_dir, exist_ok=True)
+        save_to_json(season_index_path(country, league_name, season), fixture_index)
+        checkpoint.remove()
+    print(f'scraped stats for {country} - {league_name} "{season}" season.')
+
+    return rows_written
+
+
+def scrape_season_lite(
+    base_url, country, league_name, season, page_cache=None, enrich=None
+):
+    # one request for the whole season: date, teams and score from the season page.
+    # Links that can't be read, and rows enrich(row) picks, get a full fixture scrape
+    url = f"{base_url}/{season}"
+    fixtures_info = get_fixtures_info(
+        url, request_delay=host_request_interval, lite=True
+    )
+
+    rows = {}
+    enrich_fixtures = []
+    for fixture in fixtures_info:
+        lite = fixture.get("lite")
+        if lite is not None:
+            rows[fixture.get("url")] = {
+                **lite,
+                "round": fixture.get("round"),
+                "url": fixture.get("url"),
+            }
+        if lite is None or (enrich is not None and enrich(rows[fixture.get("url")])):
+            enrich_fixtures.append(
+                {"url": fixture.get("url"), "round": fixture.get("round")}
+            )
+
+    for fixture, stats in iter_scraped_fixtures(
+        enrich_fixtures,
+        max_workers=scraper_max_workers,
+        request_delay=host_request_interval,
+        cache=page_cache,
+        parse_processes=scraper_parse_processes,
+    ):
+        row = {**stats, "url": fixture.get("url")}
+        if stats.get("ft_res"):
+            row["hg_ft"] = stats.get("hg_fh") + stats.get("hg_sh")
+            row["ag_ft"] = stats.get("ag_fh") + stats.get("ag_sh")
+        rows[fixture.get("url")] = row
+
+    file_path = lite_season_file_path(country, league_name, season)
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+
+    # season page order, fixtures whose full scrape failed are left out
+    rows_written = write_csv_stream(
+        (rows.get(f.get("url")) for f in fixtures_info if f.get("url") in rows),
+        file_path,
+        lite_field_names,
+        flush_every=csv_flush_every,
+    )
+    print(f"{url} - {rows_written} fixtures, {len(enrich_fixtures)} scraped in full")
+
+    return rows_written
+
+
+def scrape_leagues_lite(leagues_url_details):
+    # one request per season: the current season every run, past ones until stored
+    get_session(pool_size=scraper_max_workers)
+    setup_throttle()
+    page_cache = make_page_cache()
+
+    for league in leagues_url_details:
+        for season in league.get("seasons"):
+            current = season == league.get("seasons")[0]
+            file_path = lite_season_file_path(
+                league.get("country"), league.get("league_name"), season
+            )
+            if not current and os.path.exists(file_path):
+                continue
+
+            try:
+                scrape_season_lite(
+                    league.get("url"),
+                    league.get("country"),
+                    league.get("league_name"),
+                    season,
+                    page_cache,
+                )
+            except Exception as e:
+                print(
+                    f"Unexpected error occur while scraping {league.get('url')}/{season}"
+                    f" - {e}"
+                )
+
+    print(f"HTTP connections - {connection_stats()}")
+    print(f"Request throttling - {throttle_stats()}")
+    close_session()
+    save_timing_summary(timing_summary_path("lite"))
+
+
+def update_season(base_url, country, league_name, season, page_cache=None):
+    # only fixtures that are new or have been played since the last run are fetched
+    file_path = season_file_path(country, league_name, season)
+    fixture_index = load_season_index(country, league_name, season)
+
+    if fixture_index is None or not os.path.exists(file_path):
+        # no record of which row is which fixture yet, scrape the whole season once
+        return scrape_season(base_url, country, league_name, season, page_cache)
+
+    url = f"{base_url}/{season}"
+    fixtures_info = get_fixtures_info(url, request_delay=host_request_interval)
+
+    today = str(date.today())
+    stale_fixtures = []
+    for fixture in fixtures_info:
+        indexed = fixture_index.get(fixture.get("url"))
+        if (
+            indexed is None
+            or indexed.get("round") != fixture.get("round")
+            or (not indexed.get("finished") and (indexed.get("date") or "") <= today)
+        ):
+            stale_fixtures.append(fixture)
+
+    print(
+        f"{url} - {len(stale_fixtures)} of {len(fixtures_info)} fixtures new or finished"
+    )
+    if not stale_fixtures:
+        return 0
+
+    def row_key(row):
+        # date-grouped seasons have no round, None in the index and "" in the csv,
+        # the date tells apart two meetings of the same teams in such a season
+        fixture_round = row.get("round")
+        return (
+            "" if fixture_round is None else str(fixture_round),
+            str(row.get("date") or ""),
+            row.get("home_team"),
+            row.get("away_team"),
+        )
+
+    # rows the stale fixtures were stored under, a fixture moved to another
+    # round gets a new key
+    old_keys = {
+        fixture.get("url"): row_key(fixture_index.get(fixture.get("url")))
+        for fixture in stale_fixtures
+        if fixture.get("url") in fixture_index
+    }
+
+    # the stale fixtures replace their old rows, or are added if they are new
+    refreshed = {}
+    for stats in index_fixtures(
+        iter_scraped_fixtures(
+            stale_fixtures,
+            max_workers=scraper_max_workers,
+            request_delay=host_request_interval,
+            cache=page_cache,
+            refresh=True,
+            parse_processes=scraper_parse_processes,
+        ),
+        fixture_index,
+    ):
+        refreshed[row_key(stats)] = stats
+
+    with open(file_path, newline="") as file:
+        stored_rows = {row_key(row): row for row in csv.DictReader(file)}
+
+    for url, old_key in old_keys.items():
+        if old_key != row_key(fixture_index.get(url)):
+            stored_rows.pop(old_key, None)
+
+    rows = []
+    for fixture in fixtures_info:
+        indexed = fixture_index.get(fixture.get("url"))
+        if indexed is None:
+            continue
+
+        key = row_key(indexed)
+        stored_row = stored_rows.pop(key, None)
+        if key in refreshed:
+            rows.append(refreshed.pop(key))
+        elif stored_row is not None:
+            rows.append(stored_row)
+
+    # rows of fixtures no longer listed on the season page are kept
+    rows.extend(stored_rows.values())
+
+    write_csv_stream(rows, file_path, field_names, flush_every=csv_flush_every)
+    save_to_json(season_index_path(country, league_name, season), fixture_index)
+
+    return len(stale_fixtures)
+
+
+def update_current_seasons(leagues_url_details):
+    # weekly refresh of the season in progress of every league
+    get_session(pool_size=scraper_max_workers)
+    setup_throttle()
+    page_cache = make_page_cache()
+
+    for league in leagues_url_details:
+        try:
+            update_season(
+                league.get("url"),
+                league.get("country"),
+                league.get("league_name"),
+                league.get("seasons")[0],
+                page_cache,
+            )
+        except Exception as e:
+            print(f"Unexpected error occur while updating {league.get('url')} - {e}")
+
+    print(f"HTTP connections - {connection_stats()}")
+    print(f"Request throttling - {throttle_stats()}")
+    close_session()
+    print(f"Page layouts - {layout_success_rates(timing_summary().get('counters'))}")
+    save_timing_summary(timing_summary_path("update"))
 
 
 def run(leagues_url_details):
@@ -37,18 +385,17 @@ def run(leagues_url_details):
         print(f"Error creating directory: {e}")
         return
 
+    # one pooled session for the whole league batch
+    get_session(pool_size=scraper_max_workers)
+    setup_throttle()
+
+    page_cache = make_page_cache()
+
     for season in seasons[season_index:new_season_index]:
         url = f"{base_url}/{season}"
-        print(url)
-        file_name = f"{country}_{league_name}_{season}"
-        
-        try:
-            scraped_stats = scraper(url)
 
-            convert_to_csv(
-                scraped_stats, f"{directory_path}/{file_name}.csv", field_names=field_names
-            )
-            print(f'scraped stats for {country} - {league_name} "{season}" season.')
+        try:
+            scrape_season(base_url, country, league_name, season, page_cache)
         except Exception as e:
             print(f"Unexpected error occur while scraping {url}")
 
@@ -62,6 +409,15 @@ def run(leagues_url_details):
             
             save_to_json("./scraping/historical/errors_2.json", current_error)
             continue
+
+    print(f"HTTP connections - {connection_stats()}")
+    print(f"Request throttling - {throttle_stats()}")
+    if page_cache:
+        print(f"Page cache - {page_cache.stats()}")
+    close_session()
+    print(f"Page layouts - {layout_success_rates(timing_summary().get('counters'))}")
+    save_timing_summary(timing_summary_path(f"{country}_{league_name}"))
+
     # Check if this is the last league and the last season
 
     # Update state
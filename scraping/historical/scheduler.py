@@ -0,0 +1,196 @@
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime
+
+from scraping.historical.constants import (
+    scraper_max_workers,
+    scheduler_url_files,
+    scheduler_jobs_path,
+    scheduler_max_processes,
+    scheduler_time_budget,
+    scheduler_default_season_duration,
+    scheduler_max_attempts,
+    timing_dir,
+)
+from scraping.historical.run import (
+    scrape_season,
+    season_file_path,
+    make_page_cache,
+    setup_throttle,
+    timing_summary_path,
+)
+from scraping.historical.parser import layout_success_rates
+from scraping.historical.scraper import TimeBudgetExceeded
+from scraping.utils.throttle import throttle_stats
+from scraping.utils.utils import get_session
+from shared.utils.timing import profile_run, reset_timing, save_timing_summary
+from shared.utils.utils import save_to_json, load_json
+
+# page cache of the current worker process
+_page_cache = None
+
+
+def build_jobs(url_files):
+    # one job per (league, season), the same season listed twice is scraped once
+    jobs = {}
+    for url_file in url_files:
+        for league in load_json(url_file):
+            for season in league.get("seasons"):
+                job_id = f"{league.get('country')}/{league.get('league_name')}/{season}"
+                jobs.setdefault(
+                    job_id,
+                    {
+                        "id": job_id,
+                        "url": league.get("url"),
+                        "country": league.get("country"),
+                        "league_name": league.get("league_name"),
+                        "season": season,
+                    },
+                )
+
+    return list(jobs.values())
+
+
+def load_jobs_state(path):
+    try:
+        return load_json(path)
+    except FileNotFoundError:
+        return {}
+
+
+def run_job(job, deadline=None):
+    global _page_cache
+
+    # worker processes keep their session and cache between jobs
+    if _page_cache is None:
+        _page_cache = make_page_cache()
+        setup_throttle(processes=scheduler_max_processes)
+    get_session(pool_size=scraper_max_workers)
+
+    # stage timings and the optional profile are kept per season
+    job_name = job.get("id").replace("/", "_")
+    reset_timing()
+
+    started = time.monotonic()
+    try:
+        rows = profile_run(
+            scrape_season,
+            job.get("url"),
+            job.get("country"),
+            job.get("league_name"),
+            job.get("season"),
+            _page_cache,
+            deadline=deadline,
+            output_path=f"{timing_dir}/{job_name}",
+        )
+        status = "done" if rows else "failed"
+        error = None if rows else "no fixtures scraped"
+    except TimeBudgetExceeded as e:
+        # not a failed attempt, the season resumes from its checkpoint next run
+        rows = 0
+        status = "pending"
+        error = str(e)
+    except Exception as e:
+        rows = 0
+        status = "failed"
+        error = str(e)
+
+    summary = save_timing_summary(timing_summary_path(job_name))
+
+    return {
+        "status": status,
+        "error": error,
+        "rows": rows,
+        "duration": round(time.monotonic() - started, 2),
+        "throttle": throttle_stats(),
+        "layouts": layout_success_rates(summary.get("counters")),
+    }
+
+
+def run_scheduler(
+    url_files=scheduler_url_files,
+    max_processes=scheduler_max_processes,
+    time_budget=scheduler_time_budget,
+    max_attempts=scheduler_max_attempts,
+    jobs_path=scheduler_jobs_path,
+):
+    started = time.monotonic()
+    # wall clock, the worker processes stop taking fixtures at the same moment
+    deadline = time.time() + time_budget
+    jobs_state = load_jobs_state(jobs_path)
+
+    queue = []
+    for job in build_jobs(url_files):
+        state = jobs_state.setdefault(
+            job.get("id"), {"status": "pending", "attempts": 0}
+        )
+
+        # seasons scraped before the work queue existed
+        season_path = season_file_path(
+            job.get("country"), job.get("league_name"), job.get("season")
+        )
+        if state.get("status") == "pending" and os.path.exists(season_path):
+            state["status"] = "done"
+
+        if state.get("status") == "done" or state.get("attempts") >= max_attempts:
+            continue
+
+        queue.append(job)
+
+    save_to_json(jobs_path, jobs_state)
+    print(f"{len(queue)} seasons queued, running {max_processes} at a time.")
+
+    durations = []
+    running = {}
+    with ProcessPoolExecutor(max_workers=max_processes) as executor:
+        while queue or running:
+            # only start a season that is expected to finish within the budget
+            elapsed = time.monotonic() - started
+            expected = (
+                sum(durations) / len(durations)
+                if durations
+                else scheduler_default_season_duration
+            )
+
+            while (
+                queue
+                and len(running) < max_processes
+                and elapsed + expected < time_budget
+            ):
+                job = queue.pop(0)
+                running[executor.submit(run_job, job, deadline)] = job
+
+            if not running:
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                job = running.pop(future)
+
+                try:
+                    result = future.result()
+                except Exception as e:
+                    # the worker process itself died
+                    result = {"status": "failed", "error": str(e), "rows": 0}
+
+                state = jobs_state.get(job.get("id"))
+                if result.get("status") != "pending":
+                    state["attempts"] = state.get("attempts", 0) + 1
+                state["updated_at"] = datetime.now().isoformat(timespec="seconds")
+                state.update(result)
+
+                if result.get("status") == "done" and result.get("duration"):
+                    durations.append(result.get("duration"))
+
+                print(f"{job.get('id')} - {result.get('status')} {result}")
+                save_to_json(jobs_path, jobs_state)
+
+    statuses = {}
+    for state in jobs_state.values():
+        statuses[state.get("status")] = statuses.get(state.get("status"), 0) + 1
+
+    print(
+        f"Scheduler finished in {round(time.monotonic() - started)}s, "
+        f"{len(queue)} seasons not started - {statuses}"
+    )
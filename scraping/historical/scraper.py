@@ -1,130 +1,160 @@
 import json
+import multiprocessing
+import re
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime
 
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 
 from scraping.historical.parser import (
+    index_sections,
+    get_section,
+    normalize_title,
     parse_matches_stats,
     parse_teams_stats,
     parse_league_stats,
     parse_odds,
+    parse_index_fixture,
+    fingerprint_layout,
+    layout_plan,
+    record_layout,
+    TeamRegistry,
 )
-from scraping.utils.utils import safe_request
-from scraping.historical.constants import primatips_base_url
+from scraping.utils.utils import fetch_page
+from scraping.historical.constants import primatips_base_url, html_parser, team_aliases
+from shared.utils.timing import stage, drain_timing, merge_timing
 
+round_heading_id = re.compile(r"^r\d+$")
 
-def scraper(url):
-    fixtures_page = safe_request(url).text
-    fixtures_page_soup = BeautifulSoup(fixtures_page, "html.parser")
+# only the parts of the pages the scraper reads are turned into a tree
+fixture_strainer = SoupStrainer("div", id="game-details-wrapper")
+fixtures_index_strainer = SoupStrainer(
+    ["h2", "div"], class_=["standing-games-date", "gml"]
+)
 
-    fixtures_containers = fixtures_page_soup.find_all("div", class_="gml")
 
-    # get all the urls and match weeks of all fixtures
-    fixtures_info = []
-    for fixture_cont in fixtures_containers:
-        round = int(
-            fixture_cont.find_previous_sibling("h2", class_="standing-games-date")
-            .attrs.get("id")
-            .replace("r", "")
-        )
+class TimeBudgetExceeded(Exception):
+    # the fixtures parsed so far are in the checkpoint, the season resumes from there
+    pass
 
-        fixtures_urls = fixture_cont.find_all("a", class_="gma")
-        fixtures_urls = [f.attrs.get("href") for f in fixtures_urls]
 
-        for url in fixtures_urls:
-            fixtures_info.append({"url": url, "round": round})
+def scrape_fixture(fixture, request_delay=0, cache=None, refresh=False):
+    fixture_content = fetch_fixture_page(
+        fixture, request_delay=request_delay, cache=cache, refresh=refresh
+    )
+    return parse_fixture(fixture, fixture_content)
 
-    fixtures_stats = []
 
-    # fixtures = fixtures_info[0: 2]
-    fixtures = fixtures_info
-    for fixture in fixtures:
-        try:
-            fixture_content = safe_request(
-                f"{primatips_base_url}{fixture.get('url')}"
-            ).text
-
-            soup = BeautifulSoup(fixture_content, "html.parser")
-        except Exception as e:
-            print(
-                f"Unable to reach {primatips_base_url}{fixture.get('url')} - skipping..."
-            )
-            continue
+def fetch_fixture_page(fixture, request_delay=0, cache=None, refresh=False):
+    try:
+        return fetch_page(
+            f"{primatips_base_url}{fixture.get('url')}",
+            cache=cache,
+            request_delay=request_delay,
+            refresh=refresh,
+        )
+    except Exception as e:
+        return None
 
-        fixture_wrapper = soup.find("div", id="game-details-wrapper")
 
-        # fixture stats
-        fixture_stats = {}
-        try:
-            game_league_title = fixture_wrapper.find(
-                "h1", class_="game-league"
-            ).text.split("-")
-            league_name = game_league_title[0].strip()
-            league_country = game_league_title[-1].strip()
-
-            game_time = (
-                fixture_wrapper.find(class_="game-time")
-                .get_text(separator="|", strip=True)
-                .split(",")[-1]
-                .split("|")
+def parse_fixture(fixture, fixture_content):
+    # cpu-bound part of scrape_fixture, picklable so it can run in a process pool
+    try:
+        with stage("soup"):
+            soup = BeautifulSoup(
+                fixture_content, html_parser, parse_only=fixture_strainer
             )
-            game_date = datetime.strptime(game_time[0].strip(), "%d.%m.%Y").date()
-            game_kickoff = datetime.strptime(game_time[-1].strip(), "%H:%M").time()
+    except Exception as e:
+        print(f"Unable to reach {primatips_base_url}{fixture.get('url')} - skipping...")
+        return None
 
-            home_team = (
-                fixture_wrapper.find(class_="team-flag-left").find("h1").text.strip()
-            )
-            away_team = (
-                fixture_wrapper.find(class_="team-flag-right").find("h1").text.strip()
-            )
+    fixture_wrapper = soup.find("div", id="game-details-wrapper")
 
-            fixture_stats = {
-                "date": game_date,
-                "kickoff": game_kickoff,
-                "league": league_name,
-                "country": league_country,
-                "round": fixture.get("round"),
-                "home_team": home_team,
-                "away_team": away_team,
-            }
-        except Exception as e:
-            print(f"Unable to parse fixtures stats due to --> {e}")
+    # fixture stats
+    fixture_stats = {}
+    try:
+        game_league_title = fixture_wrapper.find("h1", class_="game-league").text.split(
+            "-"
+        )
+        league_name = game_league_title[0].strip()
+        league_country = game_league_title[-1].strip()
+
+        game_time = (
+            fixture_wrapper.find(class_="game-time")
+            .get_text(separator="|", strip=True)
+            .split(",")[-1]
+            .split("|")
+        )
+        game_date = datetime.strptime(game_time[0].strip(), "%d.%m.%Y").date()
+        game_kickoff = datetime.strptime(game_time[-1].strip(), "%H:%M").time()
 
-        # results
-        results = {}
-        try:
-            scores = fixture_wrapper.find(class_="game-extended-result").text.strip()
-            fh_scores = scores.split(",")[0].replace("(", "").strip().replace("-", "")
-            sh_scores = scores.split(",")[-1].replace(")", "").strip().replace("-", "")
-
-            results = {
-                "hg_fh": int(fh_scores.split(" ")[0]),
-                "hg_sh": int(sh_scores.split(" ")[0]),
-                "ag_fh": int(fh_scores.split(" ")[-1]),
-                "ag_sh": int(sh_scores.split(" ")[-1]),
-            }
-
-            if (results.get("hg_fh") + results.get("hg_sh")) > (
-                results.get("ag_fh") + results.get("ag_sh")
-            ):
-                results["ft_res"] = "H"
-            if (results.get("hg_fh") + results.get("hg_sh")) == (
-                results.get("ag_fh") + results.get("ag_sh")
-            ):
-                results["ft_res"] = "D"
-            if (results.get("hg_fh") + results.get("hg_sh")) < (
-                results.get("ag_fh") + results.get("ag_sh")
-            ):
-                results["ft_res"] = "A"
-        except Exception as e:
-            print(f"Unable to parse results due to --> {e}")
+        home_team = (
+            fixture_wrapper.find(class_="team-flag-left").find("h1").text.strip()
+        )
+        away_team = (
+            fixture_wrapper.find(class_="team-flag-right").find("h1").text.strip()
+        )
+
+        fixture_stats = {
+            "date": game_date,
+            "kickoff": game_kickoff,
+            "league": league_name,
+            "country": league_country,
+            "round": fixture.get("round"),
+            "home_team": home_team,
+            "away_team": away_team,
+        }
+    except Exception as e:
+        print(f"Unable to parse fixtures stats due to --> {e}")
+
+    # results
+    results = {}
+    try:
+        scores = fixture_wrapper.find(class_="game-extended-result").text.strip()
+        fh_scores = scores.split(",")[0].replace("(", "").strip().replace("-", "")
+        sh_scores = scores.split(",")[-1].replace(")", "").strip().replace("-", "")
+
+        results = {
+            "hg_fh": int(fh_scores.split(" ")[0]),
+            "hg_sh": int(sh_scores.split(" ")[0]),
+            "ag_fh": int(fh_scores.split(" ")[-1]),
+            "ag_sh": int(sh_scores.split(" ")[-1]),
+        }
 
-        # h2h stats
-        h2h_stats = []
+        if (results.get("hg_fh") + results.get("hg_sh")) > (
+            results.get("ag_fh") + results.get("ag_sh")
+        ):
+            results["ft_res"] = "H"
+        if (results.get("hg_fh") + results.get("hg_sh")) == (
+            results.get("ag_fh") + results.get("ag_sh")
+        ):
+            results["ft_res"] = "D"
+        if (results.get("hg_fh") + results.get("hg_sh")) < (
+            results.get("ag_fh") + results.get("ag_sh")
+        ):
+            results["ft_res"] = "A"
+    except Exception as e:
+        print(f"Unable to parse results due to --> {e}")
+
+    # section headings, indexed once for every parser below
+    sections = {}
+    try:
+        sections = index_sections(fixture_wrapper)
+    except Exception as e:
+        print(f"Unable to index sections due to --> {e}")
+
+    # sections this layout doesn't have are skipped instead of failing one by one
+    layout = fingerprint_layout(sections)
+    plan = layout_plan(layout)
+    record_layout(layout, "pages", "seen")
+
+    # h2h stats
+    h2h_stats = []
+    if "h2h" in plan:
         try:
-            h2h_table_title = fixture_wrapper.select_one(
-                "h2.games-title:-soup-contains('H2H last')"
-            )
+            h2h_table_title = get_section(sections, "h2h")
 
             no_h2h = h2h_table_title.find_next_sibling(
                 "div", class_="games-stat-no-data"
@@ -137,36 +167,42 @@ def scraper(url):
                 h2h_stats = parse_matches_stats(
                     h2h_table, fixture_stats.get("home_team"), matches_type="h2h"
                 )
+            record_layout(layout, "h2h", "ok")
         except Exception as e:
+            record_layout(layout, "h2h", "failed")
             print(f"Unable to parse H2H stats due to --> {e}")
 
-        # previous matches
-        pm_home = []
-        pm_away = []
+    # previous matches
+    pm_home = []
+    pm_away = []
+    if "prev_matches" in plan:
         try:
             league_table = (
-                fixture_wrapper.select_one("h2.games-title:-soup-contains('Table')")
+                get_section(sections, "table")
                 .find_next_sibling("table", class_="standing")
                 .find("tbody")
             )
-            league_teams = [
-                {
-                    "name": row.find("td", class_="team").text.strip().lower(),
-                    "pos": int(row.find("td", class_="position").text.strip()),
-                }
-                for row in league_table.find_all("tr")
-            ]
+            league_teams = TeamRegistry(
+                [
+                    {
+                        "name": row.find("td", class_="team").text.strip().lower(),
+                        "pos": int(row.find("td", class_="position").text.strip()),
+                    }
+                    for row in league_table.find_all("tr")
+                ],
+                aliases=team_aliases,
+            )
 
             # home team prev matches table
             ht = fixture_stats.get("home_team")
-            home_pm_table = fixture_wrapper.select_one(
-                f"h2.games-title:-soup-contains('{ht} last 12 games')"
+            home_pm_table = get_section(
+                sections, ("last_games", normalize_title(ht))
             ).find_next_sibling("table", class_="games-stat")
 
             # away team prev matches table
             at = fixture_stats.get("away_team")
-            away_pm_table = fixture_wrapper.select_one(
-                f"h2.games-title:-soup-contains('{at} last 12 games')"
+            away_pm_table = get_section(
+                sections, ("last_games", normalize_title(at))
             ).find_next_sibling("table", class_="games-stat")
 
             pm_home = parse_matches_stats(
@@ -182,61 +218,258 @@ def scraper(url):
                 matches_type="prev",
                 teams_list=league_teams,
             )
+            record_layout(layout, "prev_matches", "ok")
         except Exception as e:
+            record_layout(layout, "prev_matches", "failed")
             print(f"Unable to parse prev matches stats due to --> {e}")
 
-        # teams stats
-        teams_stats = {}
+    # teams stats
+    teams_stats = {}
+    if "teams_stats" in plan:
         try:
             teams_stats = parse_teams_stats(
                 fixture_wrapper,
                 fixture_stats.get("home_team"),
                 fixture_stats.get("away_team"),
+                sections=sections,
             )
+            record_layout(layout, "teams_stats", "ok")
         except Exception as e:
+            record_layout(layout, "teams_stats", "failed")
             print(f"Unable to parse teams stats due to --> {e}")
 
-        #  league stats
-        league_stats = {
-            "lg_mp": None,
-            "lw_hw": None,
-            "lg_draws": None,
-            "lg_aw": None,
-            "lg_avg_goals": None,
-            "lg_gsr_1": None,
-            "lg_gsr_2": None,
-            "lg_gsf_1": None,
-            "lg_gsf_2": None,
-            "lg_gg": None,
-            "lg_015": None,
-            "lg_025": None,
-            "lg_035": None,
-        }
+    #  league stats
+    league_stats = {
+        "lg_mp": None,
+        "lw_hw": None,
+        "lg_draws": None,
+        "lg_aw": None,
+        "lg_avg_goals": None,
+        "lg_gsr_1": None,
+        "lg_gsr_2": None,
+        "lg_gsf_1": None,
+        "lg_gsf_2": None,
+        "lg_gg": None,
+        "lg_015": None,
+        "lg_025": None,
+        "lg_035": None,
+    }
+    if "league_stats" in plan:
         try:
-            league_stats = parse_league_stats(fixture_wrapper)
+            league_stats = parse_league_stats(fixture_wrapper, sections=sections)
+            record_layout(layout, "league_stats", "ok")
         except Exception as e:
+            record_layout(layout, "league_stats", "failed")
             print(f"Unable to parse league stats due to --> {e}")
 
-        # odd
-        try:
-            odds_stat = parse_odds(fixture_wrapper)
-        except Exception as e:
-            raise (e)
-            print(f"Unable to parse odds due to --> {e}")
-
-        final_stats = {
-            **fixture_stats,
-            **results,
-            "h2h": json.dumps(f"{h2h_stats}"),
-            "pm_home": json.dumps(f"{pm_home}"),
-            "pm_away": json.dumps(f"{pm_away}"),
-            **teams_stats,
-            **league_stats,
-            **odds_stat,
-        }
+    # odd
+    try:
+        odds_stat = parse_odds(fixture_wrapper)
+    except Exception as e:
+        raise (e)
+        print(f"Unable to parse odds due to --> {e}")
+
+    final_stats = {
+        **fixture_stats,
+        **results,
+        "h2h": json.dumps(f"{h2h_stats}"),
+        "pm_home": json.dumps(f"{pm_home}"),
+        "pm_away": json.dumps(f"{pm_away}"),
+        **teams_stats,
+        **league_stats,
+        **odds_stat,
+    }
+
+    # print(final_stats.keys())
+
+    return final_stats
+
+
+def parse_fixture_in_process(fixture, fixture_content):
+    # the stage timings and layout counters of the parse go back with the stats
+    stats = parse_fixture(fixture, fixture_content)
+    return stats, drain_timing()
+
+
+def get_fixtures_info(url, request_delay=0, cache=None, lite=False):
+    fixtures_page = fetch_page(url, cache=cache, request_delay=request_delay)
+    return parse_fixtures_info(fixtures_page, lite=lite)
+
+
+def parse_fixtures_info(fixtures_page, lite=False):
+    # lite also reads date, teams and score from each fixture link
+    with stage("soup"):
+        fixtures_page_soup = BeautifulSoup(
+            fixtures_page, html_parser, parse_only=fixtures_index_strainer
+        )
+
+    fixtures_containers = fixtures_page_soup.find_all("div", class_="gml")
+
+    # older seasons group fixtures under date headings without a round id
+    round_headings = fixtures_page_soup.find_all(
+        "h2", class_="standing-games-date", id=round_heading_id
+    )
+    by_round = bool(round_headings)
+    record_layout(f"season by {'round' if by_round else 'date'}", "pages", "seen")
+
+    # get all the urls and match weeks of all fixtures
+    fixtures_info = []
+    for fixture_cont in fixtures_containers:
+        round = None
+        if by_round:
+            round = int(
+                fixture_cont.find_previous_sibling("h2", class_="standing-games-date")
+                .attrs.get("id")
+                .replace("r", "")
+            )
 
-        # print(final_stats.keys())
+        fixtures_links = fixture_cont.find_all("a", class_="gma")
+
+        for fixture_link in fixtures_links:
+            fixture = {"url": fixture_link.attrs.get("href"), "round": round}
+            if lite:
+                # None for links that can't be read, they need a full fixture scrape
+                fixture["lite"] = parse_index_fixture(fixture_link)
+            fixtures_info.append(fixture)
+
+    return fixtures_info
+
+
+def iter_scraped_fixtures(
+    fixtures,
+    max_workers=1,
+    request_delay=0,
+    cache=None,
+    checkpoint=None,
+    refresh=False,
+    parse_processes=0,
+    deadline=None,
+):
+    # yields (fixture, stats) pairs, refresh skips pages already in the cache.
+    # No fixture is started after deadline (a time.time() value), the ones in
+    # flight are finished and TimeBudgetExceeded is raised
+
+    # fixtures already parsed by an interrupted run of this season
+    done_fixtures = checkpoint.load() if checkpoint else {}
+    if done_fixtures:
+        print(f"Resuming season, {len(done_fixtures)} fixtures already scraped.")
+
+    # with parse_processes the threads only download, the pages are parsed on
+    # other cores. The pool is started on a download thread while other threads
+    # may hold the timing or throttle locks, spawned workers don't inherit them
+    parse_pool = (
+        ProcessPoolExecutor(
+            parse_processes, mp_context=multiprocessing.get_context("spawn")
+        )
+        if parse_processes > 0
+        else None
+    )
+    threads = max_workers + parse_processes
+
+    def fetch_fixture(fixture):
+        if fixture.get("url") in done_fixtures:
+            return done_fixtures.get(fixture.get("url"))
 
-        fixtures_stats.append(final_stats)
+        fixture_content = fetch_fixture_page(
+            fixture, request_delay=request_delay, cache=cache, refresh=refresh
+        )
+        if parse_pool is None:
+            stats = parse_fixture(fixture, fixture_content)
+        else:
+            stats, timing = parse_pool.submit(
+                parse_fixture_in_process, fixture, fixture_content
+            ).result()
+            merge_timing(timing)
+
+        if stats is not None and checkpoint:
+            checkpoint.append(fixture.get("url"), stats)
+
+        return stats
+
+    def out_of_time():
+        return deadline is not None and time.time() >= deadline
+
+    stopped = False
+    try:
+        if threads > 1:
+            # keep a bounded window of fixtures in flight and yield them in
+            # fixtures order, so memory doesn't grow with the season and
+            # downloads wait while the parsers are behind
+            with ThreadPoolExecutor(max_workers=threads) as executor:
+                in_flight = deque()
+                for fixture in fixtures:
+                    if out_of_time():
+                        stopped = True
+                        break
+                    in_flight.append((fixture, executor.submit(fetch_fixture, fixture)))
+
+                    if len(in_flight) >= threads * 2:
+                        fixture, future = in_flight.popleft()
+                        stats = future.result()
+                        # unreachable fixtures are skipped
+                        if stats is not None:
+                            yield fixture, stats
+
+                while in_flight:
+                    fixture, future = in_flight.popleft()
+                    stats = future.result()
+                    if stats is not None:
+                        yield fixture, stats
+        else:
+            for fixture in fixtures:
+                if out_of_time():
+                    stopped = True
+                    break
+                stats = fetch_fixture(fixture)
+                if stats is not None:
+                    yield fixture, stats
+
+        if stopped:
+            raise TimeBudgetExceeded("time budget spent before the season was scraped")
+    finally:
+        if parse_pool is not None:
+            parse_pool.shutdown(cancel_futures=True)
+
+
+def iter_fixtures(
+    url,
+    max_workers=1,
+    request_delay=0,
+    cache=None,
+    checkpoint=None,
+    parse_processes=0,
+):
+    fixtures_info = get_fixtures_info(url, request_delay=request_delay)
 
-    return fixtures_stats
+    # fixtures = fixtures_info[0: 2]
+    fixtures = fixtures_info
+
+    for _, stats in iter_scraped_fixtures(
+        fixtures,
+        max_workers=max_workers,
+        request_delay=request_delay,
+        cache=cache,
+        checkpoint=checkpoint,
+        parse_processes=parse_processes,
+    ):
+        yield stats
+
+
+def scraper(
+    url,
+    max_workers=1,
+    request_delay=0,
+    cache=None,
+    checkpoint=None,
+    parse_processes=0,
+):
+    return list(
+        iter_fixtures(
+            url,
+            max_workers=max_workers,
+            request_delay=request_delay,
+            cache=cache,
+            checkpoint=checkpoint,
+            parse_processes=parse_processes,
+        )
+    )
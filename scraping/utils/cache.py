@@ -0,0 +1,119 @@
+import gzip
+import hashlib
+import json
+import os
+import threading
+
+
+class PageCache:
+    # raw pages stored gzip-compressed under sha256(url), evicted least recently used first
+    def __init__(self, directory, max_bytes=1024**3, revalidate=False):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.revalidate = revalidate
+
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+
+        self._lock = threading.Lock()
+        self._sizes = {}
+
+        os.makedirs(directory, exist_ok=True)
+        for file_name in os.listdir(directory):
+            if file_name.endswith(".html.gz"):
+                key = file_name[: -len(".html.gz")]
+                self._sizes[key] = os.path.getsize(self._page_path(key))
+
+    def _key(self, url):
+        return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+    def _page_path(self, key):
+        return os.path.join(self.directory, f"{key}.html.gz")
+
+    def _meta_path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, url):
+        key = self._key(url)
+        page_path = self._page_path(key)
+
+        try:
+            with gzip.open(page_path, "rt", encoding="utf-8") as page_file:
+                content = page_file.read()
+            with open(self._meta_path(key), "r") as meta_file:
+                meta = json.load(meta_file)
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        # bump the access time used by the LRU eviction
+        os.utime(page_path)
+
+        with self._lock:
+            self.hits += 1
+
+        return {"content": content, **meta}
+
+    def put(self, url, content, etag=None, last_modified=None):
+        key = self._key(url)
+        page_path = self._page_path(key)
+
+        # write to temp files first so concurrent readers never see half a page
+        tmp_page_path = f"{page_path}.{threading.get_ident()}.tmp"
+        with gzip.open(tmp_page_path, "wt", encoding="utf-8") as page_file:
+            page_file.write(content)
+        os.replace(tmp_page_path, page_path)
+
+        meta = {"url": url, "etag": etag, "last_modified": last_modified}
+        tmp_meta_path = f"{self._meta_path(key)}.{threading.get_ident()}.tmp"
+        with open(tmp_meta_path, "w") as meta_file:
+            json.dump(meta, meta_file)
+        os.replace(tmp_meta_path, self._meta_path(key))
+
+        with self._lock:
+            self._sizes[key] = os.path.getsize(page_path)
+            self._evict()
+
+    def touch(self, url):
+        key = self._key(url)
+        try:
+            os.utime(self._page_path(key))
+        except OSError:
+            pass
+
+        with self._lock:
+            self.revalidated += 1
+
+    def _evict(self):
+        total_bytes = sum(self._sizes.values())
+        if total_bytes <= self.max_bytes:
+            return
+
+        def last_access(key):
+            try:
+                return os.path.getmtime(self._page_path(key))
+            except OSError:
+                return 0
+
+        for key in sorted(self._sizes, key=last_access):
+            if total_bytes <= self.max_bytes:
+                break
+
+            total_bytes -= self._sizes.pop(key)
+            for path in (self._page_path(key), self._meta_path(key)):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "revalidated": self.revalidated,
+                "pages": len(self._sizes),
+                "bytes": sum(self._sizes.values()),
+            }
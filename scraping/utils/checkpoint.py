@@ -0,0 +1,46 @@
+import json
+import os
+import threading
+
+
+class FixtureCheckpoint:
+    # one JSON line per parsed fixture, keyed by the fixture url
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def load(self):
+        rows = {}
+        try:
+            with open(self.path, "r") as checkpoint_file:
+                for line in checkpoint_file:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # a line cut short by a crash, that fixture is scraped again
+                        continue
+                    rows[entry.get("url")] = entry.get("row")
+        except FileNotFoundError:
+            pass
+
+        return rows
+
+    def append(self, url, row):
+        # dates and times are stored as str(), which is what the CSV writer uses too
+        line = json.dumps({"url": url, "row": row}, default=str, ensure_ascii=False)
+
+        with self._lock:
+            with open(self.path, "a") as checkpoint_file:
+                checkpoint_file.write(f"{line}\n")
+                checkpoint_file.flush()
+                os.fsync(checkpoint_file.fileno())
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,129 @@
+import random
+import threading
+import time
+
+# defaults, changed with configure_throttle()
+throttle_settings = {
+    "burst": 2,  # requests that may go out back to back after an idle spell
+    "rate_share": 1.0,  # fraction of the host rate this process may use
+    "min_rate": 0.2,  # requests per second the limiter never slows down below
+    "recovery": 0.05,  # requests per second regained after each success
+    "failure_threshold": 5,  # consecutive failures that trip the breaker
+    "cooldown": 60,  # seconds the breaker stays open
+}
+
+_throttles = {}
+_throttles_lock = threading.Lock()
+
+
+def configure_throttle(**settings):
+    throttle_settings.update(settings)
+
+
+class HostThrottle:
+    # token bucket per host, slowed down on 429/503 and sped back up on success,
+    # plus a circuit breaker that pauses every worker while the host is failing
+    def __init__(self, max_rate):
+        self.max_rate = max_rate
+        self.rate = max_rate
+        self.capacity = throttle_settings.get("burst")
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+        self.failures = 0
+        self.open_until = 0
+        self.cooldown = throttle_settings.get("cooldown")
+
+        self.requests = 0
+        self.throttled = 0
+        self.trips = 0
+        self.waited = 0.0
+
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        # checked again after every sleep, a breaker tripped meanwhile still holds
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+
+                if now < self.open_until:
+                    wait = self.open_until - now
+                elif self.tokens >= 1:
+                    self.tokens -= 1
+                    self.requests += 1
+                    return
+                else:
+                    wait = (1 - self.tokens) / self.rate
+
+                self.waited += wait
+
+            time.sleep(wait)
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self.cooldown = throttle_settings.get("cooldown")
+            self.rate = min(
+                self.max_rate, self.rate + throttle_settings.get("recovery")
+            )
+
+    def failure(self, retry_after=None, throttled=False):
+        with self._lock:
+            now = time.monotonic()
+            self.failures += 1
+
+            if throttled:
+                self.throttled += 1
+                self.rate = max(throttle_settings.get("min_rate"), self.rate / 2)
+
+            if retry_after:
+                # nobody requests the host before the server said so
+                self.open_until = max(self.open_until, now + retry_after)
+
+            if self.failures >= throttle_settings.get("failure_threshold"):
+                print(f"Circuit breaker open, pausing requests for {self.cooldown}s")
+                self.open_until = max(self.open_until, now + self.cooldown)
+                self.trips += 1
+                self.failures = 0
+                # a host still failing after the pause is left alone for longer
+                self.cooldown = min(self.cooldown * 2, 15 * 60)
+
+            # no burst right after a failure
+            self.tokens = min(self.tokens, 0)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "rate": round(self.rate, 2),
+                "requests": self.requests,
+                "throttled": self.throttled,
+                "breaker_trips": self.trips,
+                "waited": round(self.waited, 2),
+            }
+
+
+def get_throttle(host, min_interval):
+    with _throttles_lock:
+        throttle = _throttles.get(host)
+        if throttle is None:
+            max_rate = throttle_settings.get("rate_share") / min_interval
+            throttle = _throttles[host] = HostThrottle(max_rate)
+
+    return throttle
+
+
+def throttle_stats():
+    with _throttles_lock:
+        return {host: throttle.stats() for host, throttle in _throttles.items()}
+
+
+def backoff_delay(retry, retry_delay, retry_after=None):
+    # exponential backoff with jitter, never shorter than the server's Retry-After
+    delay = retry_delay * 2**retry * random.uniform(0.5, 1.5)
+    return max(delay, retry_after or 0)
@@ -1,4 +1,5 @@
 import requests
+from requests.adapters import HTTPAdapter
 from requests.exceptions import (
     RequestException,
     Timeout,
@@ -7,26 +8,139 @@ from requests.exceptions import (
     InvalidURL,
     TooManyRedirects,
 )
+import threading
 import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
 
+from scraping.utils.throttle import get_throttle, backoff_delay
+from shared.utils.timing import stage, count
 from shared.utils.utils import save_to_json
 
+request_headers = {
+    "User-Agent": "Mozilla/5.0 (X11; Linux x86_64; rv:122.0) Gecko/20100101 Firefox/122.0",
+    "Connection": "keep-alive",
+}
 
-def safe_request(url, max_retries=3, retry_delay=2, timeout=10):
+# shared session, so every request of a league batch reuses pooled connections
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session(pool_size=10):
+    global _session
+
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            # requests negotiates gzip/deflate, and br when brotli is installed
+            session.headers.update(request_headers)
+
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+
+            _session = session
+
+    return _session
+
+
+def close_session():
+    global _session
+
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+
+
+def connection_stats():
+    stats = {"requests": 0, "opened": 0, "reused": 0}
+
+    if _session is None:
+        return stats
+
+    # http:// and https:// share the same adapter
+    adapters = {id(adapter): adapter for adapter in _session.adapters.values()}
+
+    for adapter in adapters.values():
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools[key]
+            stats["requests"] += pool.num_requests
+            stats["opened"] += pool.num_connections
+
+    stats["reused"] = stats["requests"] - stats["opened"]
+    return stats
+
+
+def host_throttle(url, min_interval):
+    if min_interval <= 0:
+        return None
+    return get_throttle(urlparse(url).netloc, min_interval)
+
+
+def retry_after_seconds(response):
+    # Retry-After holds either a number of seconds or an HTTP date
+    value = response.headers.get("Retry-After") if response is not None else None
+    if not value:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+def safe_request(
+    url, max_retries=3, retry_delay=2, timeout=10, request_delay=0, headers=None
+):
     retryable_exceptions = (Timeout, ConnectionError)
+    # the site answers these while it throttles us or is briefly down
+    retryable_statuses = (429, 502, 503, 504)
+
+    # shared by every worker requesting the same host
+    throttle = host_throttle(url, request_delay)
 
     for retry in range(max_retries + 1):
         try:
-            headers = {
-                "User-Agent": "Mozilla/5.0 (X11; Linux x86_64; rv:122.0) Gecko/20100101 Firefox/122.0"
-            }
-            response = requests.get(url, headers=headers, timeout=timeout)
+            if throttle:
+                throttle.acquire()
+            with stage("request"):
+                response = get_session().get(url, headers=headers, timeout=timeout)
+            count("requests")
+            count("bytes_downloaded", len(response.content))
             response.raise_for_status()  # Raise an exception for HTTP errors
+
+            if throttle:
+                throttle.success()
             return response  # Successful response
 
         except HTTPError as e:
             print(f"HTTP error (Attempt {retry + 1}/{max_retries + 1}): {e}")
-            return None  # HTTP errors are not retryable
+
+            status_code = e.response.status_code if e.response is not None else None
+            if status_code not in retryable_statuses:
+                return None  # other HTTP errors are not retryable
+
+            retry_after = retry_after_seconds(e.response)
+            if throttle:
+                throttle.failure(retry_after=retry_after, throttled=True)
+
+            if retry < max_retries:
+                delay = backoff_delay(retry, retry_delay, retry_after)
+                print(f"Retrying in {round(delay, 1)} seconds...")
+                time.sleep(delay)
+            else:
+                print("Max retries reached. Request failed.")
+                return None
 
         except InvalidURL as e:
             print(f"Inalid URL (Attempt {retry + 1}/{max_retries + 1}): {e}")
@@ -48,9 +162,13 @@ def safe_request(url, max_retries=3, retry_delay=2, timeout=10):
                         f"Connection error (Attempt {retry + 1}/{max_retries + 1}): {e}"
                     )
 
+                if throttle:
+                    throttle.failure()
+
                 if retry < max_retries:
-                    print(f"Retrying in {retry_delay} seconds...")
-                    time.sleep(retry_delay)
+                    delay = backoff_delay(retry, retry_delay)
+                    print(f"Retrying in {round(delay, 1)} seconds...")
+                    time.sleep(delay)
                 else:
                     print("Max retries reached. Request failed.")
                     return None
@@ -58,6 +176,41 @@ def safe_request(url, max_retries=3, retry_delay=2, timeout=10):
                 print("Request failed due to unknown error: ", e)
 
 
+def fetch_page(url, cache=None, request_delay=0, refresh=False):
+    if cache is None:
+        response = safe_request(url, request_delay=request_delay)
+        return response.text if response is not None else None
+
+    # a refreshed page is always downloaded again, and replaces the cached copy
+    cached_page = cache.get(url) if not refresh else None
+    if cached_page and not cache.revalidate:
+        return cached_page.get("content")
+
+    # conditional request, the server answers 304 if the cached page is still fresh
+    headers = {}
+    if cached_page:
+        if cached_page.get("etag"):
+            headers["If-None-Match"] = cached_page.get("etag")
+        if cached_page.get("last_modified"):
+            headers["If-Modified-Since"] = cached_page.get("last_modified")
+
+    response = safe_request(url, request_delay=request_delay, headers=headers)
+    if response is None:
+        return cached_page.get("content") if cached_page else None
+
+    if response.status_code == 304 and cached_page:
+        cache.touch(url)
+        return cached_page.get("content")
+
+    cache.put(
+        url,
+        response.text,
+        etag=response.headers.get("ETag"),
+        last_modified=response.headers.get("Last-Modified"),
+    )
+    return response.text
+
+
 def footystats_seperator(stats_data: []):
     overall_stats_list = []
     home_stats_list = []
@@ -1,3 +1,7 @@
+from functools import cached_property, lru_cache
+
+import numpy as np
+import pandas as pd
 from scipy.stats import poisson
 
 
@@ -14,120 +18,327 @@ def calculate_expected_goals(gsrh, gcrh, gsra, gcra, gsrlh, gsrla):
     return {"home": round(xgh, 2), "away": round(xga, 2)}
 
 
-def calculate_probabilities_with_odds(home_expected_goals, away_expected_goals):
-    max_goals = 10  # Calculate probabilities for up to 10 goals (can be adjusted)
-
-    # Calculate Poisson probabilities for home and away goals
-    home_goal_probs = [
-        (poisson.pmf(i, home_expected_goals)) for i in range(max_goals + 1)
-    ]
-    away_goal_probs = [
-        (poisson.pmf(i, away_expected_goals)) for i in range(max_goals + 1)
-    ]
-
-    # Calculate probabilities for home win, draw, and away win
-    home_win_prob = sum(
-        home_goal_probs[i] * sum(away_goal_probs[:i]) for i in range(1, max_goals + 1)
-    )
-    draw_prob = sum(
-        home_goal_probs[i] * away_goal_probs[i] for i in range(max_goals + 1)
-    )
-    away_win_prob = sum(
-        away_goal_probs[i] * sum(home_goal_probs[:i]) for i in range(1, max_goals + 1)
-    )
+def truncation_bound(expected_goals, tolerance=1e-10):
+    # smallest goal count whose Poisson tail is below tolerance for every team
+    highest_xg = float(np.max(expected_goals))
+    if highest_xg <= 0:
+        return 1
 
-    # Double chance markets
-    home_win_or_draw = home_win_prob + draw_prob
-    away_win_or_draw = away_win_prob + draw_prob
-    home_win_or_away_win = home_win_prob + away_win_prob
-
-    # Calculate BTTS (Both Teams To Score)
-    # btts_prob = 1 - (
-    #     home_goal_probs[0] * sum(away_goal_probs)
-    #     + away_goal_probs[0] * sum(home_goal_probs)
-    # )
-
-    # Calculate over 1.5, over 2.5, over 3.5, and over 4.5 goals
-    fixture_avg_goals = home_expected_goals + away_expected_goals
-    over_0_5_prob = 1 - poisson.cdf(0, fixture_avg_goals)
-    over_1_5_prob = 1 - poisson.cdf(1, fixture_avg_goals)
-    over_2_5_prob = 1 - poisson.cdf(2, fixture_avg_goals)
-    over_3_5_prob = 1 - poisson.cdf(3, fixture_avg_goals)
-    over_4_5_prob = 1 - poisson.cdf(4, fixture_avg_goals)
-
-    # Home team over goals probabilities
-    home_over_0_5 = 1 - poisson.cdf(0, home_expected_goals)
-    home_over_1_5 = 1 - poisson.cdf(1, home_expected_goals)
-    home_over_2_5 = 1 - poisson.cdf(2, home_expected_goals)
-    home_over_3_5 = 1 - poisson.cdf(3, home_expected_goals)
-
-    # Away team over goals probabilities
-    away_over_0_5 = 1 - poisson.cdf(0, away_expected_goals)
-    away_over_1_5 = 1 - poisson.cdf(1, away_expected_goals)
-    away_over_2_5 = 1 - poisson.cdf(2, away_expected_goals)
-    away_over_3_5 = 1 - poisson.cdf(3, away_expected_goals)
-
-    btts_prob = home_over_0_5 * away_over_0_5
-
-    # Handicap betting probabilities
-    home_minus_1 = sum(
-        home_goal_probs[i] * sum(away_goal_probs[:i]) for i in range(2, max_goals + 1)
-    )
-    home_minus_2 = sum(
-        home_goal_probs[i] * sum(away_goal_probs[: i - 1])
-        for i in range(3, max_goals + 1)
+    return int(poisson.isf(tolerance, highest_xg)) + 1
+
+
+@lru_cache(maxsize=64)
+def market_masks(max_goals):
+    # [home goals, away goals] masks, one per market priced off the score grid
+    home_goals = np.arange(max_goals + 1)[:, None]
+    away_goals = np.arange(max_goals + 1)[None, :]
+    goal_diff = home_goals - away_goals
+    total_goals = home_goals + away_goals
+    grid_shape = (max_goals + 1, max_goals + 1)
+
+    masks = {
+        "home_win": goal_diff > 0,
+        "draw": goal_diff == 0,
+        "away_win": goal_diff < 0,
+        "btts": (home_goals > 0) & (away_goals > 0),
+        "home_minus_1": (goal_diff > 0) & (home_goals >= 2),
+        "home_minus_2": (goal_diff > 1) & (home_goals >= 3),
+        "home_minus_3": (goal_diff > 2) & (home_goals >= 4),
+        "away_minus_1": (goal_diff < 0) & (away_goals >= 2),
+        "away_minus_2": (goal_diff < -1) & (away_goals >= 3),
+        "away_minus_3": (goal_diff < -2) & (away_goals >= 4),
+    }
+    for line in range(5):
+        masks[f"o{line}5"] = total_goals > line
+    for line in range(4):
+        masks[f"home_o{line}5"] = np.broadcast_to(home_goals > line, grid_shape)
+        masks[f"away_o{line}5"] = np.broadcast_to(away_goals > line, grid_shape)
+
+    return masks
+
+
+def score_grid_markets(score_grid):
+    # score_grid: (fixtures, home goals, away goals)
+    max_goals = score_grid.shape[-1] - 1
+    grid_markets = {
+        market: np.einsum("nij,ij->n", score_grid, mask)
+        for market, mask in market_masks(max_goals).items()
+    }
+
+    home_win_prob = grid_markets.get("home_win")
+    draw_prob = grid_markets.get("draw")
+    away_win_prob = grid_markets.get("away_win")
+
+    markets = {
+        "home_win": home_win_prob,
+        "draw": draw_prob,
+        "away_win": away_win_prob,
+        "_1x": home_win_prob + draw_prob,
+        "x2": away_win_prob + draw_prob,
+        "_12": home_win_prob + away_win_prob,
+        "btts": grid_markets.get("btts"),
+    }
+    for line in range(5):
+        markets[f"o{line}5"] = grid_markets.get(f"o{line}5")
+        markets[f"u{line}5"] = 1 - grid_markets.get(f"o{line}5")
+    for team in ("home", "away"):
+        for line in range(4):
+            markets[f"{team}_o{line}5"] = grid_markets.get(f"{team}_o{line}5")
+    for team in ("home", "away"):
+        for handicap in range(1, 4):
+            market = f"{team}_minus_{handicap}"
+            markets[market] = grid_markets.get(market)
+
+    return markets
+
+
+def joint_score_grid(
+    home_expected_goals, away_expected_goals, max_goals, rho=0.0, covariance=0.0
+):
+    # (fixtures, home goals, away goals); covariance > 0 gives a bivariate Poisson
+    # with the same marginal means, rho applies the Dixon-Coles low score correction
+    home_xg = np.atleast_1d(np.asarray(home_expected_goals, dtype=float))
+    away_xg = np.atleast_1d(np.asarray(away_expected_goals, dtype=float))
+    covariance = np.broadcast_to(np.asarray(covariance, dtype=float), home_xg.shape)
+    rho = np.broadcast_to(np.asarray(rho, dtype=float), home_xg.shape)
+
+    # the shared goals come out of both means, a larger covariance leaves a
+    # negative Poisson rate and a grid of NaNs. 0 expected goals is fine without one
+    if np.any(covariance < 0) or np.any(
+        (covariance > 0) & (covariance >= np.minimum(home_xg, away_xg))
+    ):
+        raise ValueError(
+            "covariance must be at least 0 and below both expected goals, "
+            f"got {covariance} for expected goals {home_xg} and {away_xg}"
+        )
+
+    goals = np.arange(max_goals + 1)
+    home_goal_probs = poisson.pmf(goals[None, :], (home_xg - covariance)[:, None])
+    away_goal_probs = poisson.pmf(goals[None, :], (away_xg - covariance)[:, None])
+    score_grid = home_goal_probs[:, :, None] * away_goal_probs[:, None, :]
+
+    if np.any(covariance > 0):
+        # X = W1 + W3, Y = W2 + W3: sum over the shared goals k
+        shared_goal_probs = poisson.pmf(goals[None, :], covariance[:, None])
+        bivariate_grid = np.zeros_like(score_grid)
+        for k in range(max_goals + 1):
+            bivariate_grid[:, k:, k:] += (
+                shared_goal_probs[:, k, None, None]
+                * score_grid[:, : max_goals + 1 - k, : max_goals + 1 - k]
+            )
+        score_grid = bivariate_grid
+
+    if np.any(rho != 0):
+        score_grid = score_grid.copy()
+        home_rate = home_xg - covariance
+        away_rate = away_xg - covariance
+        score_grid[:, 0, 0] *= 1 - home_rate * away_rate * rho
+        score_grid[:, 0, 1] *= 1 + home_rate * rho
+        score_grid[:, 1, 0] *= 1 + away_rate * rho
+        score_grid[:, 1, 1] *= 1 - rho
+
+    return score_grid
+
+
+def outcome_label(goal_diff):
+    return np.where(goal_diff > 0, "H", np.where(goal_diff < 0, "A", "D"))
+
+
+def goal_diff_probs(home_expected_goals, away_expected_goals, tolerance):
+    # distribution of home minus away goals, index 0 is -max_goals
+    max_goals = truncation_bound([home_expected_goals, away_expected_goals], tolerance)
+    goals = np.arange(max_goals + 1)
+    score_grid = np.outer(
+        poisson.pmf(goals, home_expected_goals), poisson.pmf(goals, away_expected_goals)
     )
-    home_minus_3 = sum(
-        home_goal_probs[i] * sum(away_goal_probs[: i - 2])
-        for i in range(4, max_goals + 1)
+
+    goal_diff = goals[:, None] - goals[None, :]
+    probs = np.bincount(
+        (goal_diff + max_goals).ravel(),
+        weights=score_grid.ravel(),
+        minlength=2 * max_goals + 1,
     )
+    return np.arange(-max_goals, max_goals + 1), probs
+
+
+class ScoreGrid:
+    # joint (home goals, away goals) distribution of one fixture, every market reads from it
+    def __init__(
+        self,
+        home_expected_goals,
+        away_expected_goals,
+        tolerance=1e-10,
+        first_half_share=0.45,
+        rho=0.0,
+        covariance=0.0,
+    ):
+        self.home_expected_goals = float(home_expected_goals)
+        self.away_expected_goals = float(away_expected_goals)
+        self.tolerance = tolerance
+        self.first_half_share = first_half_share
+        self.rho = rho
+        self.covariance = covariance
+
+        self.max_goals = truncation_bound(
+            [self.home_expected_goals, self.away_expected_goals], tolerance
+        )
+        self.goals = np.arange(self.max_goals + 1)
+        self.grid = joint_score_grid(
+            self.home_expected_goals,
+            self.away_expected_goals,
+            self.max_goals,
+            rho=rho,
+            covariance=covariance,
+        )[0]
+        self.home_goal_probs = self.grid.sum(axis=1)
+        self.away_goal_probs = self.grid.sum(axis=0)
 
-    away_minus_1 = sum(
-        away_goal_probs[i] * sum(home_goal_probs[:i]) for i in range(2, max_goals + 1)
+    @cached_property
+    def total_goal_probs(self):
+        total_goals = self.goals[:, None] + self.goals[None, :]
+        return np.bincount(total_goals.ravel(), weights=self.grid.ravel())
+
+    @cached_property
+    def goal_diff_probs(self):
+        goal_diff = self.goals[:, None] - self.goals[None, :]
+        probs = np.bincount(
+            (goal_diff + self.max_goals).ravel(),
+            weights=self.grid.ravel(),
+            minlength=2 * self.max_goals + 1,
+        )
+        return np.arange(-self.max_goals, self.max_goals + 1), probs
+
+    def correct_score(self, home_goals, away_goals):
+        if home_goals > self.max_goals or away_goals > self.max_goals:
+            return 0.0
+        return float(self.grid[home_goals, away_goals])
+
+    def correct_scores(self, top=None):
+        # "home-away" -> probability, most likely scores first
+        order = np.argsort(self.grid, axis=None)[::-1][:top]
+        home_goals, away_goals = np.unravel_index(order, self.grid.shape)
+        return {
+            f"{h}-{a}": float(self.grid[h, a]) for h, a in zip(home_goals, away_goals)
+        }
+
+    def over(self, line):
+        totals = np.arange(len(self.total_goal_probs))
+        return float(self.total_goal_probs[totals > line].sum())
+
+    def under(self, line):
+        # whole lines push, so over + under < 1 there
+        totals = np.arange(len(self.total_goal_probs))
+        return float(self.total_goal_probs[totals < line].sum())
+
+    def team_over(self, team, line):
+        goal_probs = self.home_goal_probs if team == "home" else self.away_goal_probs
+        return float(goal_probs[self.goals > line].sum())
+
+    def team_under(self, team, line):
+        goal_probs = self.home_goal_probs if team == "home" else self.away_goal_probs
+        return float(goal_probs[self.goals < line].sum())
+
+    def asian_handicap(self, line, team="home"):
+        # quarter lines split the stake over the two neighbouring lines
+        if (line * 4) % 2 == 1:
+            lower = self.asian_handicap(line - 0.25, team)
+            upper = self.asian_handicap(line + 0.25, team)
+            return {k: (lower[k] + upper[k]) / 2 for k in lower}
+
+        goal_diff, probs = self.goal_diff_probs
+        margin = (goal_diff if team == "home" else -goal_diff) + line
+
+        return {
+            "win": float(probs[margin > 0].sum()),
+            "push": float(probs[margin == 0].sum()),
+            "lose": float(probs[margin < 0].sum()),
+        }
+
+    def btts(self):
+        return float(self.grid[1:, 1:].sum())
+
+    def odd_even(self):
+        return {
+            "odd": float(self.total_goal_probs[1::2].sum()),
+            "even": float(self.total_goal_probs[0::2].sum()),
+        }
+
+    def half_time_full_time(self):
+        # each half is its own Poisson process, split by first_half_share
+        first_half_diff, first_half_probs = goal_diff_probs(
+            self.home_expected_goals * self.first_half_share,
+            self.away_expected_goals * self.first_half_share,
+            self.tolerance,
+        )
+        second_half_diff, second_half_probs = goal_diff_probs(
+            self.home_expected_goals * (1 - self.first_half_share),
+            self.away_expected_goals * (1 - self.first_half_share),
+            self.tolerance,
+        )
+
+        joint = np.outer(first_half_probs, second_half_probs)
+        half_time = outcome_label(first_half_diff)[:, None]
+        full_time = outcome_label(first_half_diff[:, None] + second_half_diff[None, :])
+
+        return {
+            f"{ht}/{ft}": float(joint[(half_time == ht) & (full_time == ft)].sum())
+            for ht in ("H", "D", "A")
+            for ft in ("H", "D", "A")
+        }
+
+    def markets(self):
+        return {k: float(v[0]) for k, v in score_grid_markets(self.grid[None]).items()}
+
+
+@lru_cache(maxsize=4096)
+def get_score_grid(home_expected_goals, away_expected_goals, rho=0.0, covariance=0.0):
+    # fixtures with the same (rounded) expected goals share one grid
+    return ScoreGrid(
+        home_expected_goals, away_expected_goals, rho=rho, covariance=covariance
     )
-    away_minus_2 = sum(
-        away_goal_probs[i] * sum(home_goal_probs[: i - 1])
-        for i in range(3, max_goals + 1)
+
+
+def market_probabilities(
+    home_expected_goals, away_expected_goals, max_goals=None, rho=0.0, covariance=0.0
+):
+    # expected goals can be scalars or arrays of any number of fixtures
+    home_xg = np.atleast_1d(np.asarray(home_expected_goals, dtype=float))
+    away_xg = np.atleast_1d(np.asarray(away_expected_goals, dtype=float))
+
+    if max_goals is None:
+        max_goals = truncation_bound(np.concatenate([home_xg, away_xg]))
+
+    # joint score grid of every fixture, built once: (fixtures, home goals, away goals)
+    score_grid = joint_score_grid(
+        home_xg, away_xg, max_goals, rho=rho, covariance=covariance
     )
-    away_minus_3 = sum(
-        away_goal_probs[i] * sum(home_goal_probs[: i - 2])
-        for i in range(4, max_goals + 1)
+
+    return score_grid_markets(score_grid)
+
+
+def calculate_probabilities_with_odds_batch(
+    home_expected_goals, away_expected_goals, rho=0.0, covariance=0.0
+):
+    # one row per fixture, one column per market
+    probabilities_raw = pd.DataFrame(
+        market_probabilities(
+            home_expected_goals, away_expected_goals, rho=rho, covariance=covariance
+        )
     )
 
-    # Prepare result dictionary with probabilities
-    probabilities_raw = {
-        "home_win": home_win_prob,
-        "draw": draw_prob,
-        "away_win": away_win_prob,
-        "_1x": home_win_or_draw,
-        "x2": away_win_or_draw,
-        "_12": home_win_or_away_win,
-        "btts": btts_prob,
-        "o05": over_0_5_prob,
-        "u05": 1 - over_0_5_prob,
-        "o15": over_1_5_prob,
-        "u15": 1 - over_1_5_prob,
-        "o25": over_2_5_prob,
-        "u25": 1 - over_2_5_prob,
-        "o35": over_3_5_prob,
-        "u35": 1 - over_3_5_prob,
-        "o45": over_4_5_prob,
-        "u45": 1 - over_4_5_prob,
-        "home_o05": home_over_0_5,
-        "home_o15": home_over_1_5,
-        "home_o25": home_over_2_5,
-        "home_o35": home_over_3_5,
-        "away_o05": away_over_0_5,
-        "away_o15": away_over_1_5,
-        "away_o25": away_over_2_5,
-        "away_o35": away_over_3_5,
-        "home_minus_1": home_minus_1,
-        "home_minus_2": home_minus_2,
-        "home_minus_3": home_minus_3,
-        "away_minus_1": away_minus_1,
-        "away_minus_2": away_minus_2,
-        "away_minus_3": away_minus_3,
-    }
+    probabilities_percent = (probabilities_raw * 100).round(2)
+
+    # Calculate corresponding odds from probabilities
+    with np.errstate(divide="ignore"):
+        odds = (1 / probabilities_raw).round(2)
+
+    return {"probabilities": probabilities_percent, "odds": odds}
+
+
+def calculate_probabilities_with_odds(home_expected_goals, away_expected_goals):
+    probabilities_raw = get_score_grid(
+        home_expected_goals, away_expected_goals
+    ).markets()
 
     probabilities_percent = {
         k: float(round(v * 100, 2)) for k, v in probabilities_raw.items()
@@ -0,0 +1,282 @@
+import glob
+
+import numpy as np
+import pandas as pd
+from scipy.optimize import minimize
+from scipy.special import gammaln
+
+from shared.utils.math_utils import get_score_grid
+
+result_columns = ["date", "home_team", "away_team", "hg_fh", "hg_sh", "ag_fh", "ag_sh"]
+
+
+def season_paths(country, league_name, root="shared/data/historical"):
+    return sorted(glob.glob(f"{root}/{country}/{country}_{league_name}_*.csv"))
+
+
+def load_results(paths):
+    # only the result columns are read, the match history blobs are skipped
+    frames = [pd.read_csv(path, usecols=result_columns) for path in paths]
+    results = pd.concat(frames, ignore_index=True).dropna()
+
+    results["date"] = pd.to_datetime(results["date"])
+    results["home_goals"] = (results["hg_fh"] + results["hg_sh"]).astype(int)
+    results["away_goals"] = (results["ag_fh"] + results["ag_sh"]).astype(int)
+
+    return results[["date", "home_team", "away_team", "home_goals", "away_goals"]]
+
+
+def time_decay_weights(dates, xi, reference_date=None):
+    # exp(-xi * days before the reference date), xi = 0 weighs every match the same
+    if reference_date is None:
+        reference_date = dates.max() + pd.Timedelta(days=1)
+
+    days_ago = (pd.Timestamp(reference_date) - dates).dt.days.to_numpy()
+    return np.exp(-xi * np.clip(days_ago, 0, None))
+
+
+def dixon_coles_tau(home_goals, away_goals, home_rate, away_rate, rho):
+    # tau and its derivatives by log home rate, log away rate and rho
+    tau = np.ones_like(home_rate)
+    d_home = np.zeros_like(home_rate)
+    d_away = np.zeros_like(home_rate)
+    d_rho = np.zeros_like(home_rate)
+
+    low_00 = (home_goals == 0) & (away_goals == 0)
+    low_01 = (home_goals == 0) & (away_goals == 1)
+    low_10 = (home_goals == 1) & (away_goals == 0)
+    low_11 = (home_goals == 1) & (away_goals == 1)
+
+    rates_00 = home_rate[low_00] * away_rate[low_00]
+    tau[low_00] = 1 - rates_00 * rho
+    d_home[low_00] = d_away[low_00] = -rates_00 * rho
+    d_rho[low_00] = -rates_00
+
+    tau[low_01] = 1 + home_rate[low_01] * rho
+    d_home[low_01] = home_rate[low_01] * rho
+    d_rho[low_01] = home_rate[low_01]
+
+    tau[low_10] = 1 + away_rate[low_10] * rho
+    d_away[low_10] = away_rate[low_10] * rho
+    d_rho[low_10] = away_rate[low_10]
+
+    tau[low_11] = 1 - rho
+    d_rho[low_11] = -1
+
+    return np.clip(tau, 1e-10, None), d_home, d_away, d_rho
+
+
+def bivariate_sum(home_goals, away_goals, home_rate, away_rate, shared_rate):
+    # S = sum_k C(x, k) C(y, k) k! r^k with r = shared / (home * away), over every
+    # match at once, and d log S / d log r
+    ratio = shared_rate / (home_rate * away_rate)
+    total = np.ones_like(home_rate)
+    weighted_total = np.zeros_like(home_rate)
+    term = np.ones_like(home_rate)
+
+    shared_goals = np.minimum(home_goals, away_goals)
+    for k in range(1, int(shared_goals.max(initial=0)) + 1):
+        term = np.where(
+            shared_goals >= k,
+            term * (home_goals - k + 1) * (away_goals - k + 1) / k * ratio,
+            0,
+        )
+        total += term
+        weighted_total += k * term
+
+    return total, weighted_total / total
+
+
+def negative_log_likelihood(params, data, n_teams, model):
+    # weighted negative log likelihood and its gradient
+    attack = params[:n_teams] - params[:n_teams].mean()
+    defence = params[n_teams : 2 * n_teams]
+    home_advantage = params[2 * n_teams]
+    extra = params[2 * n_teams + 1]
+
+    home_idx = data.get("home_idx")
+    away_idx = data.get("away_idx")
+    home_goals = data.get("home_goals")
+    away_goals = data.get("away_goals")
+    weights = data.get("weights")
+
+    log_home_rate = home_advantage + attack[home_idx] + defence[away_idx]
+    log_away_rate = attack[away_idx] + defence[home_idx]
+    home_rate = np.exp(log_home_rate)
+    away_rate = np.exp(log_away_rate)
+
+    log_likelihood = (
+        home_goals * log_home_rate
+        - home_rate
+        + away_goals * log_away_rate
+        - away_rate
+        - data.get("log_factorials")
+    )
+    d_home = home_goals - home_rate
+    d_away = away_goals - away_rate
+
+    if model == "dixon_coles":
+        tau, tau_home, tau_away, tau_rho = dixon_coles_tau(
+            home_goals, away_goals, home_rate, away_rate, extra
+        )
+        log_likelihood += np.log(tau)
+        d_home += tau_home / tau
+        d_away += tau_away / tau
+        d_extra = tau_rho / tau
+    else:
+        shared_rate = np.exp(extra)
+        total, d_log_total = bivariate_sum(
+            home_goals, away_goals, home_rate, away_rate, shared_rate
+        )
+        log_likelihood += -shared_rate + np.log(total)
+        d_home -= d_log_total
+        d_away -= d_log_total
+        d_extra = d_log_total - shared_rate
+
+    d_home *= weights
+    d_away *= weights
+
+    d_attack = np.bincount(home_idx, d_home, n_teams) + np.bincount(
+        away_idx, d_away, n_teams
+    )
+    d_defence = np.bincount(away_idx, d_home, n_teams) + np.bincount(
+        home_idx, d_away, n_teams
+    )
+    gradient = np.concatenate(
+        [
+            # attack is centred, so the gradient of the raw params is centred too
+            d_attack - d_attack.mean(),
+            d_defence,
+            [d_home.sum(), (weights * d_extra).sum()],
+        ]
+    )
+
+    return -(weights * log_likelihood).sum(), -gradient
+
+
+class TeamStrengthModel:
+    # fitted log attack / defence strengths, rates are exp(home + attack + defence)
+    def __init__(self, teams, attack, defence, home_advantage, model, extra):
+        self.teams = list(teams)
+        self.team_index = {team: index for index, team in enumerate(self.teams)}
+        self.attack = np.asarray(attack)
+        self.defence = np.asarray(defence)
+        self.home_advantage = float(home_advantage)
+        self.model = model
+        self.rho = float(extra) if model == "dixon_coles" else 0.0
+        self.covariance = float(np.exp(extra)) if model == "bivariate" else 0.0
+
+    def expected_goals(self, home_team, away_team):
+        home = self.team_index.get(home_team)
+        away = self.team_index.get(away_team)
+
+        home_rate = np.exp(self.home_advantage + self.attack[home] + self.defence[away])
+        away_rate = np.exp(self.attack[away] + self.defence[home])
+
+        # marginal means, the bivariate model adds the shared component to both
+        return {
+            "home": float(home_rate + self.covariance),
+            "away": float(away_rate + self.covariance),
+        }
+
+    def score_grid(self, home_team, away_team):
+        expected_goals = self.expected_goals(home_team, away_team)
+        return get_score_grid(
+            round(expected_goals.get("home"), 4),
+            round(expected_goals.get("away"), 4),
+            rho=round(self.rho, 4),
+            covariance=round(self.covariance, 4),
+        )
+
+    def params(self):
+        extra = self.rho if self.model == "dixon_coles" else np.log(self.covariance)
+        return {
+            "model": self.model,
+            "teams": self.teams,
+            "attack": self.attack.tolist(),
+            "defence": self.defence.tolist(),
+            "home_advantage": self.home_advantage,
+            "extra": float(extra),
+        }
+
+
+def fit_model(
+    results,
+    model="dixon_coles",
+    xi=0.0,
+    reference_date=None,
+    warm_start=None,
+):
+    teams = sorted(set(results["home_team"]) | set(results["away_team"]))
+    team_index = {team: index for index, team in enumerate(teams)}
+    n_teams = len(teams)
+
+    home_goals = results["home_goals"].to_numpy()
+    away_goals = results["away_goals"].to_numpy()
+    data = {
+        "home_idx": results["home_team"].map(team_index).to_numpy(),
+        "away_idx": results["away_team"].map(team_index).to_numpy(),
+        "home_goals": home_goals,
+        "away_goals": away_goals,
+        "log_factorials": gammaln(home_goals + 1) + gammaln(away_goals + 1),
+        "weights": time_decay_weights(results["date"], xi, reference_date),
+    }
+
+    # promoted teams start from zero, the rest from the previous fit
+    initial = np.zeros(2 * n_teams + 2)
+    initial[2 * n_teams] = 0.25
+    initial[2 * n_teams + 1] = 0.0 if model == "dixon_coles" else -2.0
+    if warm_start is not None and warm_start.model == model:
+        previous = warm_start.params()
+        for team, index in team_index.items():
+            previous_index = warm_start.team_index.get(team)
+            if previous_index is not None:
+                initial[index] = previous.get("attack")[previous_index]
+                initial[n_teams + index] = previous.get("defence")[previous_index]
+        initial[2 * n_teams] = previous.get("home_advantage")
+        initial[2 * n_teams + 1] = previous.get("extra")
+
+    extra_bounds = (-0.3, 0.3) if model == "dixon_coles" else (-10.0, 0.0)
+    bounds = [(None, None)] * (2 * n_teams + 1) + [extra_bounds]
+
+    fit = minimize(
+        negative_log_likelihood,
+        initial,
+        args=(data, n_teams, model),
+        jac=True,
+        method="L-BFGS-B",
+        bounds=bounds,
+    )
+    if not fit.success:
+        print(f"Model fit did not converge --> {fit.message}")
+
+    params = fit.x
+    return TeamStrengthModel(
+        teams,
+        params[:n_teams] - params[:n_teams].mean(),
+        params[n_teams : 2 * n_teams],
+        params[2 * n_teams],
+        model,
+        params[2 * n_teams + 1],
+    )
+
+
+def fit_league(country, league_name, model="dixon_coles", xi=0.0):
+    # one fit per season, each warm started from the season before it
+    fitted = {}
+    previous = None
+
+    seasons = []
+    for path in season_paths(country, league_name):
+        results = load_results([path])
+        if not results.empty:
+            seasons.append((path[: -len(".csv")].split("_")[-1], results))
+
+    # oldest season first, so warm starts run forward in time
+    seasons.sort(key=lambda season: season[1]["date"].min())
+
+    for season, results in seasons:
+        previous = fit_model(results, model=model, xi=xi, warm_start=previous)
+        fitted[season] = previous
+
+    return fitted
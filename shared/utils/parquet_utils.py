@@ -0,0 +1,275 @@
+import ast
+import csv
+import json
+import os
+import re
+from datetime import date, time
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+# hive partitions, kept apart from the "country" / "league" display names in the rows
+partition_schema = pa.schema(
+    [
+        ("country_slug", pa.string()),
+        ("league_slug", pa.string()),
+        ("season", pa.string()),
+    ]
+)
+partitioning = ds.partitioning(partition_schema, flavor="hive")
+
+h2h_type = pa.list_(
+    pa.struct(
+        [
+            ("date", pa.date32()),
+            ("gf", pa.int32()),
+            ("ga", pa.int32()),
+            ("venue", pa.string()),
+        ]
+    )
+)
+prev_matches_type = pa.list_(
+    pa.struct(
+        [
+            ("date", pa.date32()),
+            ("gf", pa.int32()),
+            ("ga", pa.int32()),
+            ("venue", pa.string()),
+            ("home_team", pa.string()),
+            ("away_team", pa.string()),
+            ("home_pos", pa.int32()),
+            ("away_pos", pa.int32()),
+        ]
+    )
+)
+
+string_fields = ["league", "country", "home_team", "away_team", "ft_res"]
+# matches played, positions, counts and league percentages
+int_fields = [
+    "round",
+    "hg_fh",
+    "hg_sh",
+    "ag_fh",
+    "ag_sh",
+    "h_mp_0",
+    "h_mp_1",
+    "a_mp_0",
+    "a_mp_2",
+    "h_pos_0",
+    "h_pos_1",
+    "a_pos_0",
+    "a_pos_2",
+    "h_o15_1",
+    "h_o25_1",
+    "h_o35_1",
+    "h_gg_1",
+    "h_cs_1",
+    "h_fts_1",
+    "a_o15_2",
+    "a_o25_2",
+    "a_o35_2",
+    "a_gg_2",
+    "a_cs_2",
+    "a_fts_2",
+    "lg_mp",
+    "lw_hw",
+    "lg_draws",
+    "lg_aw",
+    "lg_gsf_1",
+    "lg_gsf_2",
+    "lg_gg",
+    "lg_015",
+    "lg_025",
+    "lg_035",
+]
+# rates, odds and prima probabilities
+float_fields = [
+    "h_gsr_0",
+    "h_gcr_0",
+    "h_gsr_1",
+    "h_gcr_1",
+    "a_gsr_0",
+    "a_gcr_0",
+    "a_gsr_2",
+    "a_gcr_2",
+    "h_ppg_0",
+    "h_ppg_1",
+    "a_ppg_0",
+    "a_ppg_2",
+    "lg_avg_goals",
+    "lg_gsr_1",
+    "lg_gsr_2",
+    "hw_odds",
+    "draw_odds",
+    "aw_odds",
+    "1x_odds",
+    "x2_odds",
+    "o15_odds",
+    "u15_odds",
+    "o25_odds",
+    "u25_odds",
+    "o35_odds",
+    "u35_odds",
+    "gg_yes_odds",
+    "gg_no_odds",
+    "hw_prima_prob",
+    "draw_prima_prob",
+    "aw_prima_prob",
+    "1x_prima_prob",
+    "x2_prima_prob",
+    "o15_prima_prob",
+    "u15_prima_prob",
+    "o25_prima_prob",
+    "u25_prima_prob",
+    "o35_prima_prob",
+    "u35_prima_prob",
+    "gg_yes_prima_prob",
+    "gg_no_prima_prob",
+]
+
+historical_schema = pa.schema(
+    [
+        ("date", pa.date32()),
+        ("kickoff", pa.time32("s")),
+        *[(field, pa.string()) for field in string_fields],
+        *[(field, pa.int32()) for field in int_fields],
+        ("h2h", h2h_type),
+        ("pm_home", prev_matches_type),
+        ("pm_away", prev_matches_type),
+        *[(field, pa.float64()) for field in float_fields],
+        *partition_schema,
+    ]
+)
+
+date_repr = re.compile(r"datetime\.date\((\d+), (\d+), (\d+)\)")
+
+
+def to_int(value):
+    if value is None or value == "":
+        return None
+    return int(float(value))
+
+
+def to_float(value):
+    if value is None or value == "":
+        return None
+    return float(value)
+
+
+def to_date(value):
+    if value is None or value == "":
+        return None
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(value)
+
+
+def to_time(value):
+    if value is None or value == "":
+        return None
+    if isinstance(value, time):
+        return value
+    return time.fromisoformat(value)
+
+
+def parse_match_history(value):
+    # h2h / pm_* are json.dumps() of the repr of a list of dicts holding datetime.date
+    if not value:
+        return []
+
+    history_repr = json.loads(value) if value.startswith('"') else value
+    history_repr = date_repr.sub(r"'\1-\2-\3'", history_repr)
+
+    matches = ast.literal_eval(history_repr)
+    for match in matches:
+        year, month, day = match.get("date").split("-")
+        match["date"] = date(int(year), int(month), int(day))
+
+    return matches
+
+
+def to_arrow_row(row, country_slug, league_slug, season):
+    # takes csv rows (all strings) as well as rows straight from the scraper
+    arrow_row = {
+        "date": to_date(row.get("date")),
+        "kickoff": to_time(row.get("kickoff")),
+        "h2h": parse_match_history(row.get("h2h")),
+        "pm_home": parse_match_history(row.get("pm_home")),
+        "pm_away": parse_match_history(row.get("pm_away")),
+        "country_slug": country_slug,
+        "league_slug": league_slug,
+        "season": season,
+    }
+
+    for field in string_fields:
+        arrow_row[field] = row.get(field) or None
+    for field in int_fields:
+        arrow_row[field] = to_int(row.get(field))
+    for field in float_fields:
+        arrow_row[field] = to_float(row.get(field))
+
+    return arrow_row
+
+
+def convert_to_parquet(data: [], root, country_slug, league_slug, season):
+    if not data:
+        print("No objects provided. Parquet file not created.")
+        return
+
+    table = pa.Table.from_pylist(
+        [to_arrow_row(row, country_slug, league_slug, season) for row in data],
+        schema=historical_schema,
+    )
+
+    # re-writing a season replaces its partition instead of adding a second file
+    ds.write_dataset(
+        table,
+        root,
+        format="parquet",
+        partitioning=partitioning,
+        basename_template="part-{i}.parquet",
+        existing_data_behavior="delete_matching",
+    )
+
+    print(
+        f"Parquet partition {country_slug}/{league_slug}/{season} written to '{root}'."
+    )
+
+
+def convert_csv_tree(csv_root="shared/data/historical", root="shared/data/parquet"):
+    converted = 0
+
+    for country_slug in sorted(os.listdir(csv_root)):
+        country_path = os.path.join(csv_root, country_slug)
+        if not os.path.isdir(country_path):
+            continue
+
+        for file_name in sorted(os.listdir(country_path)):
+            if not file_name.endswith(".csv"):
+                continue
+
+            # <country>_<league>_<season>.csv
+            _, league_slug, season = file_name[: -len(".csv")].split("_")
+
+            with open(os.path.join(country_path, file_name), newline="") as file:
+                rows = list(csv.DictReader(file))
+
+            convert_to_parquet(rows, root, country_slug, league_slug, season)
+            converted += 1
+
+    print(f"{converted} season files converted to '{root}'.")
+    return converted
+
+
+def read_historical(root="shared/data/parquet", columns=None, filters=None):
+    # columns are projected and filters pushed down to the partitions / row groups,
+    # e.g. filters=[("country_slug", "=", "spain"), ("date", ">=", date(2020, 1, 1))]
+    table = pq.read_table(
+        root,
+        columns=columns,
+        filters=filters,
+        partitioning=partitioning,
+        schema=historical_schema,
+    )
+    return table.to_pandas()
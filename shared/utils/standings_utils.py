@@ -0,0 +1,212 @@
+import pandas as pd
+
+from shared.utils.model_utils import load_results
+
+# the parse_teams_stats fields the engine reproduces
+standings_fields = [
+    "h_mp_0",
+    "h_mp_1",
+    "a_mp_0",
+    "a_mp_2",
+    "h_pos_0",
+    "h_pos_1",
+    "a_pos_0",
+    "a_pos_2",
+    "h_gsr_0",
+    "h_gcr_0",
+    "h_gsr_1",
+    "h_gcr_1",
+    "a_gsr_0",
+    "a_gcr_0",
+    "a_gsr_2",
+    "a_gcr_2",
+    "h_ppg_0",
+    "h_ppg_1",
+    "a_ppg_0",
+    "a_ppg_2",
+]
+
+
+def rate(value, matches):
+    # same rounding as parser.smart_avg
+    if matches < 1:
+        return 0
+    return round(value / matches, 2)
+
+
+def new_record():
+    return {"mp": 0, "w": 0, "d": 0, "l": 0, "gf": 0, "ga": 0, "pts": 0}
+
+
+def add_result(record, goals_for, goals_against):
+    record["mp"] += 1
+    record["gf"] += goals_for
+    record["ga"] += goals_against
+
+    if goals_for > goals_against:
+        record["w"] += 1
+        record["pts"] += 3
+    elif goals_for == goals_against:
+        record["d"] += 1
+        record["pts"] += 1
+    else:
+        record["l"] += 1
+
+
+class StandingsEngine:
+    # running overall / home / away tables of one season, updated in O(1) per match
+    def __init__(self, teams=()):
+        self.tables = {"overall": {}, "home": {}, "away": {}}
+        for team in teams:
+            self.add_team(team)
+
+    def add_team(self, team):
+        for table in self.tables.values():
+            table.setdefault(team, new_record())
+
+    def apply(self, home_team, away_team, home_goals, away_goals):
+        self.add_team(home_team)
+        self.add_team(away_team)
+
+        add_result(self.tables["overall"][home_team], home_goals, away_goals)
+        add_result(self.tables["overall"][away_team], away_goals, home_goals)
+        add_result(self.tables["home"][home_team], home_goals, away_goals)
+        add_result(self.tables["away"][away_team], away_goals, home_goals)
+
+    def record(self, team, table="overall"):
+        return self.tables[table].get(team) or new_record()
+
+    def positions(self, table="overall"):
+        # points, goal difference, goals scored; only sorted when asked for
+        ranked = sorted(
+            self.tables[table].items(),
+            key=lambda item: (
+                -item[1]["pts"],
+                -(item[1]["gf"] - item[1]["ga"]),
+                -item[1]["gf"],
+                item[0],
+            ),
+        )
+        return {team: position for position, (team, _) in enumerate(ranked, start=1)}
+
+    def table_positions(self):
+        return {table: self.positions(table) for table in self.tables}
+
+    def features(self, home_team, away_team, table_positions=None):
+        # table_positions from table_positions() can be shared by every match of
+        # a matchday, otherwise the three tables are sorted for this match
+        if table_positions is None:
+            table_positions = self.table_positions()
+        overall_positions = table_positions.get("overall")
+        home_positions = table_positions.get("home")
+        away_positions = table_positions.get("away")
+
+        home_overall = self.record(home_team)
+        home_home = self.record(home_team, "home")
+        away_overall = self.record(away_team)
+        away_away = self.record(away_team, "away")
+
+        return {
+            # matches played
+            "h_mp_0": home_overall["mp"],
+            "h_mp_1": home_home["mp"],
+            "a_mp_0": away_overall["mp"],
+            "a_mp_2": away_away["mp"],
+            # positions
+            "h_pos_0": overall_positions.get(home_team),
+            "h_pos_1": home_positions.get(home_team),
+            "a_pos_0": overall_positions.get(away_team),
+            "a_pos_2": away_positions.get(away_team),
+            # gsr and gcr
+            "h_gsr_0": rate(home_overall["gf"], home_overall["mp"]),
+            "h_gcr_0": rate(home_overall["ga"], home_overall["mp"]),
+            "h_gsr_1": rate(home_home["gf"], home_home["mp"]),
+            "h_gcr_1": rate(home_home["ga"], home_home["mp"]),
+            "a_gsr_0": rate(away_overall["gf"], away_overall["mp"]),
+            "a_gcr_0": rate(away_overall["ga"], away_overall["mp"]),
+            "a_gsr_2": rate(away_away["gf"], away_away["mp"]),
+            "a_gcr_2": rate(away_away["ga"], away_away["mp"]),
+            # ppg
+            "h_ppg_0": rate(home_overall["pts"], home_overall["mp"]),
+            "h_ppg_1": rate(home_home["pts"], home_home["mp"]),
+            "a_ppg_0": rate(away_overall["pts"], away_overall["mp"]),
+            "a_ppg_2": rate(away_away["pts"], away_away["mp"]),
+        }
+
+
+def replay_season(results):
+    # yields (match, features before its matchday) in date order; matches on the
+    # same date all see the table as it was before that day
+    results = results.sort_values("date", kind="stable")
+    engine = StandingsEngine(set(results["home_team"]) | set(results["away_team"]))
+
+    for _, matchday in results.groupby("date", sort=True):
+        matches = list(matchday.itertuples(index=False))
+        # the tables are sorted once per matchday, not once per match
+        table_positions = engine.table_positions()
+        features = [
+            engine.features(m.home_team, m.away_team, table_positions) for m in matches
+        ]
+
+        for match, match_features in zip(matches, features):
+            yield match, match_features
+
+        for match in matches:
+            engine.apply(
+                match.home_team, match.away_team, match.home_goals, match.away_goals
+            )
+
+
+def standings_as_of(results, as_of):
+    # tables with every match played before as_of
+    engine = StandingsEngine(set(results["home_team"]) | set(results["away_team"]))
+    played = results[results["date"] < pd.Timestamp(as_of)].sort_values("date")
+
+    for match in played.itertuples(index=False):
+        engine.apply(
+            match.home_team, match.away_team, match.home_goals, match.away_goals
+        )
+
+    return engine
+
+
+def season_features(path):
+    # pre-match standings features of every fixture of a season csv
+    rows = [
+        {
+            "date": match.date,
+            "home_team": match.home_team,
+            "away_team": match.away_team,
+            **features,
+        }
+        for match, features in replay_season(load_results([path]))
+    ]
+    return pd.DataFrame(
+        rows, columns=["date", "home_team", "away_team"] + standings_fields
+    )
+
+
+def cross_check(path, tolerance=0.01):
+    # share of fixtures where the computed value matches the scraped one, per field.
+    # The site's tables may lag a matchday or order ties differently, and the scraped
+    # h_mp_0 holds the away team's matches played
+    computed = season_features(path)
+    scraped = pd.read_csv(
+        path, usecols=["date", "home_team", "away_team"] + standings_fields
+    )
+    scraped["date"] = pd.to_datetime(scraped["date"])
+
+    merged = computed.merge(
+        scraped, on=["date", "home_team", "away_team"], suffixes=("", "_scraped")
+    )
+
+    agreement = {}
+    for field in standings_fields:
+        both = merged[[field, f"{field}_scraped"]].dropna()
+        if both.empty:
+            agreement[field] = None
+            continue
+        matches = (both[field] - both[f"{field}_scraped"]).abs() <= tolerance
+        agreement[field] = round(float(matches.mean()), 3)
+
+    return {"fixtures": len(merged), "agreement": agreement}
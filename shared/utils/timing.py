@@ -0,0 +1,202 @@
+import cProfile
+import functools
+import io
+import json
+import os
+import pstats
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# upper bounds of the latency histogram buckets, in milliseconds
+histogram_bounds_ms = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000]
+
+# "cprofile" or "pyinstrument" turns on the profiler in profile_run()
+profile_env_var = "FORM_ANALYSIS_PROFILE"
+
+_stages = {}
+_counters = {}
+_timing_lock = threading.Lock()
+_started = time.monotonic()
+
+
+def record(stage_name, seconds):
+    milliseconds = seconds * 1000
+    bucket = bisect_left(histogram_bounds_ms, milliseconds)
+
+    with _timing_lock:
+        stats = _stages.get(stage_name)
+        if stats is None:
+            stats = _stages[stage_name] = {
+                "count": 0,
+                "total_ms": 0.0,
+                "max_ms": 0.0,
+                "buckets": [0] * (len(histogram_bounds_ms) + 1),
+            }
+
+        stats["count"] += 1
+        stats["total_ms"] += milliseconds
+        stats["max_ms"] = max(stats["max_ms"], milliseconds)
+        stats["buckets"][bucket] += 1
+
+
+def count(counter_name, value=1):
+    with _timing_lock:
+        _counters[counter_name] = _counters.get(counter_name, 0) + value
+
+
+@contextmanager
+def stage(stage_name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage_name, time.perf_counter() - started)
+
+
+def timed(stage_name):
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with stage(stage_name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def bucket_percentile(buckets, total_count, percentile):
+    # upper bound of the bucket the percentile falls in
+    target = total_count * percentile
+    seen = 0
+    for bound, bucket_count in zip(histogram_bounds_ms + [None], buckets):
+        seen += bucket_count
+        if seen >= target:
+            return bound
+    return None
+
+
+def timing_summary():
+    with _timing_lock:
+        stages = {}
+        for stage_name, stats in sorted(_stages.items()):
+            labels = [f"<={bound}ms" for bound in histogram_bounds_ms] + [
+                f">{histogram_bounds_ms[-1]}ms"
+            ]
+            stages[stage_name] = {
+                "count": stats["count"],
+                "total_s": round(stats["total_ms"] / 1000, 3),
+                "mean_ms": round(stats["total_ms"] / stats["count"], 3),
+                "max_ms": round(stats["max_ms"], 3),
+                "p50_ms": bucket_percentile(stats["buckets"], stats["count"], 0.5),
+                "p95_ms": bucket_percentile(stats["buckets"], stats["count"], 0.95),
+                "histogram": {
+                    label: bucket_count
+                    for label, bucket_count in zip(labels, stats["buckets"])
+                    if bucket_count
+                },
+            }
+
+        return {
+            "wall_time_s": round(time.monotonic() - _started, 3),
+            "stages": stages,
+            "counters": dict(_counters),
+        }
+
+
+def reset_timing():
+    global _started
+
+    with _timing_lock:
+        _stages.clear()
+        _counters.clear()
+        _started = time.monotonic()
+
+
+def drain_timing():
+    # stages and counters recorded since the last drain, a worker process sends
+    # them back with each result for merge_timing() in the parent
+    with _timing_lock:
+        drained = {"stages": dict(_stages), "counters": dict(_counters)}
+        _stages.clear()
+        _counters.clear()
+
+    return drained
+
+
+def merge_timing(drained):
+    with _timing_lock:
+        for stage_name, stats in drained.get("stages").items():
+            merged = _stages.get(stage_name)
+            if merged is None:
+                _stages[stage_name] = stats
+                continue
+
+            merged["count"] += stats["count"]
+            merged["total_ms"] += stats["total_ms"]
+            merged["max_ms"] = max(merged["max_ms"], stats["max_ms"])
+            merged["buckets"] = [
+                merged_count + bucket_count
+                for merged_count, bucket_count in zip(
+                    merged["buckets"], stats["buckets"]
+                )
+            ]
+
+        for counter_name, value in drained.get("counters").items():
+            _counters[counter_name] = _counters.get(counter_name, 0) + value
+
+
+def save_timing_summary(path):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    summary = timing_summary()
+    with open(path, "w") as json_file:
+        json.dump(summary, json_file, indent=4)
+
+    print(f"Timing summary written to '{path}'.")
+    return summary
+
+
+def profile_run(function, *args, output_path="profile", **kwargs):
+    # cProfile only sees the calling thread, pyinstrument samples every thread
+    profiler_name = os.environ.get(profile_env_var, "").lower()
+
+    directory = os.path.dirname(output_path)
+    if profiler_name and directory:
+        os.makedirs(directory, exist_ok=True)
+
+    if profiler_name == "pyinstrument":
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            print("pyinstrument is not installed, running without the profiler.")
+            return function(*args, **kwargs)
+
+        profiler = Profiler()
+        profiler.start()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            profiler.stop()
+            with open(f"{output_path}.html", "w") as html_file:
+                html_file.write(profiler.output_html())
+            print(profiler.output_text(unicode=True, color=False))
+
+    if profiler_name == "cprofile":
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(function, *args, **kwargs)
+        finally:
+            profiler.dump_stats(f"{output_path}.prof")
+
+            report = io.StringIO()
+            pstats.Stats(profiler, stream=report).sort_stats("cumulative").print_stats(
+                30
+            )
+            print(report.getvalue())
+
+    return function(*args, **kwargs)
@@ -0,0 +1,206 @@
+import csv
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, time as dt_time
+from itertools import islice
+
+from shared.utils.supabase_config import get_supabase
+
+# the table needs a unique constraint on these columns for the upsert, e.g.
+# alter table historical_fixtures add constraint historical_fixtures_key
+#     unique (league, season, date, home_team, away_team);
+upload_table = "historical_fixtures"
+upload_key = ["league", "season", "date", "home_team", "away_team"]
+upload_batch_size = 500
+upload_max_batches = 4
+upload_checkpoint_path = "shared/data/upload_checkpoint.jsonl"
+
+
+def batch_digest(records):
+    # a batch whose rows changed since it was sent, e.g. a season csv refreshed by
+    # update_season, gets a new digest and is upserted again
+    content = json.dumps(records, sort_keys=True, default=str)
+    return hashlib.sha1(content.encode()).hexdigest()
+
+
+class UploadCheckpoint:
+    # one JSON line per uploaded batch, keyed by its source and content digest
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def load(self):
+        done = set()
+        try:
+            with open(self.path, "r") as checkpoint_file:
+                for line in checkpoint_file:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # a line cut short by a crash, that batch is sent again
+                        continue
+                    done.add((entry.get("source"), entry.get("digest")))
+        except FileNotFoundError:
+            pass
+
+        return done
+
+    def append(self, source, batch, digest, rows):
+        line = json.dumps(
+            {"source": source, "batch": batch, "digest": digest, "rows": rows}
+        )
+
+        with self._lock:
+            with open(self.path, "a") as checkpoint_file:
+                checkpoint_file.write(f"{line}\n")
+                checkpoint_file.flush()
+                os.fsync(checkpoint_file.fileno())
+
+
+def to_record(row, season):
+    # csv rows are all strings and scraper rows hold dates, both end up as JSON
+    record = {"season": season}
+    for field, value in row.items():
+        if value == "":
+            value = None
+        elif isinstance(value, (date, dt_time)):
+            value = value.isoformat()
+        record[field] = value
+
+    return record
+
+
+def iter_batches(rows, season, batch_size):
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            return
+
+        # postgres refuses an upsert touching the same key twice, the last row wins
+        records = {}
+        for row in batch:
+            record = to_record(row, season)
+            records[tuple(record.get(field) for field in upload_key)] = record
+
+        yield list(records.values())
+
+
+def upsert_batch(client, records, table, max_retries=3, retry_delay=2):
+    for attempt in range(max_retries):
+        try:
+            client.table(table).upsert(
+                records, on_conflict=",".join(upload_key)
+            ).execute()
+            return True
+        except Exception as e:
+            print(f"Upsert of {len(records)} rows failed --> {e}")
+            if attempt < max_retries - 1:
+                time.sleep(retry_delay * 2**attempt)
+
+    return False
+
+
+def upload_rows(
+    rows,
+    season,
+    source,
+    client=None,
+    table=upload_table,
+    batch_size=upload_batch_size,
+    max_batches=upload_max_batches,
+    checkpoint=None,
+    done_batches=None,
+):
+    # rows can be any iterable, e.g. iter_fixtures() of a season being scraped
+    if client is None:
+        client = get_supabase()
+    if done_batches is None:
+        done_batches = checkpoint.load() if checkpoint is not None else set()
+
+    def send(batch_number, digest, records):
+        if not upsert_batch(client, records, table):
+            return 0
+        if checkpoint is not None:
+            checkpoint.append(source, batch_number, digest, len(records))
+        return len(records)
+
+    uploaded = 0
+    failed = 0
+    with ThreadPoolExecutor(max_workers=max_batches) as executor:
+        # at most twice max_batches batches are held in memory at once
+        pending = deque()
+        for batch_number, records in enumerate(iter_batches(rows, season, batch_size)):
+            digest = batch_digest(records)
+            if (source, digest) in done_batches:
+                continue
+
+            pending.append(executor.submit(send, batch_number, digest, records))
+            if len(pending) >= max_batches * 2:
+                sent = pending.popleft().result()
+                uploaded += sent
+                failed += 0 if sent else 1
+
+        while pending:
+            sent = pending.popleft().result()
+            uploaded += sent
+            failed += 0 if sent else 1
+
+    if failed:
+        print(f"{source} - {failed} batches failed, they are retried on the next run")
+
+    return uploaded
+
+
+def upload_historical(
+    root="shared/data/historical",
+    client=None,
+    table=upload_table,
+    batch_size=upload_batch_size,
+    max_batches=upload_max_batches,
+    checkpoint_path=upload_checkpoint_path,
+):
+    checkpoint = UploadCheckpoint(checkpoint_path)
+    done_batches = checkpoint.load()
+    uploaded = 0
+
+    for country in sorted(os.listdir(root)):
+        country_path = os.path.join(root, country)
+        if not os.path.isdir(country_path):
+            continue
+
+        for file_name in sorted(os.listdir(country_path)):
+            if not file_name.endswith(".csv"):
+                continue
+
+            # <country>_<league>_<season>.csv
+            season = file_name[: -len(".csv")].split("_")[-1]
+            path = os.path.join(country_path, file_name)
+
+            with open(path, newline="") as file:
+                rows = upload_rows(
+                    csv.DictReader(file),
+                    season,
+                    path,
+                    client=client,
+                    table=table,
+                    batch_size=batch_size,
+                    max_batches=max_batches,
+                    checkpoint=checkpoint,
+                    done_batches=done_batches,
+                )
+
+            print(f"{path} - {rows} rows uploaded")
+            uploaded += rows
+
+    print(f"{uploaded} rows uploaded to '{table}'.")
+    return uploaded
@@ -2,7 +2,10 @@ import json
 import os
 import csv
 
+from shared.utils.timing import stage, timed
 
+
+@timed("save_to_json")
 def save_to_json(file_path, data):
     with open(file_path, "w") as json_file:
         json.dump(data, json_file, indent=4, ensure_ascii=False)
@@ -32,6 +35,7 @@ def merge_json_files(directory, output_file):
         json.dump(merged_data, outfile, indent=4)
 
 
+@timed("convert_to_csv")
 def convert_to_csv(data: [], path, field_names):
     if not data:
         print("No objects provided. CSV file not created.")
@@ -51,3 +55,33 @@ def convert_to_csv(data: [], path, field_names):
             writer.writerow(obj)
 
     print(f"CSV file '{path}' has been created successfully.")
+
+
+def write_csv_stream(rows, path, field_names, flush_every=50):
+    # rows can be any iterable, e.g. a generator, and are written as they arrive
+    part_path = f"{path}.part"
+    rows_written = 0
+
+    with open(part_path, mode="w", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=field_names)
+        writer.writeheader()
+
+        # only the writes are timed, rows may come from a scraper still running
+        for row in rows:
+            with stage("csv_write"):
+                writer.writerow(row)
+                rows_written += 1
+
+                if rows_written % flush_every == 0:
+                    file.flush()
+
+    # the csv only shows up under its final name once it is complete
+    if not rows_written:
+        os.remove(part_path)
+        print("No objects provided. CSV file not created.")
+        return 0
+
+    os.replace(part_path, path)
+    print(f"CSV file '{path}' has been created successfully.")
+
+    return rows_written
@@ -0,0 +1,50 @@
+import unittest
+
+import numpy as np
+
+from shared.utils.math_utils import (
+    ScoreGrid,
+    calculate_probabilities_with_odds,
+    calculate_probabilities_with_odds_batch,
+)
+
+
+class ZeroExpectedGoalsTest(unittest.TestCase):
+    # smart_avg gives 0 for a team without matches or goals early in a season
+
+    def test_scalar(self):
+        result = calculate_probabilities_with_odds(0.0, 1.0)
+        probabilities = result.get("probabilities")
+
+        self.assertEqual(probabilities.get("home_win"), 0.0)
+        self.assertAlmostEqual(probabilities.get("away_win"), 63.21, places=2)
+        self.assertEqual(result.get("odds").get("home_win"), float("inf"))
+
+    def test_batch(self):
+        result = calculate_probabilities_with_odds_batch(
+            [0.0, 1.2, 0.0], [1.0, 0.0, 0.0]
+        )
+        probabilities = result.get("probabilities")
+
+        self.assertFalse(probabilities.isna().any().any())
+        self.assertEqual(probabilities.loc[0, "home_win"], 0.0)
+        self.assertEqual(probabilities.loc[1, "away_win"], 0.0)
+        self.assertEqual(probabilities.loc[2, "draw"], 100.0)
+
+
+class CovarianceTest(unittest.TestCase):
+    def test_covariance_above_expected_goals(self):
+        with self.assertRaises(ValueError):
+            ScoreGrid(0.2, 1.0, covariance=0.3)
+
+    def test_negative_covariance(self):
+        with self.assertRaises(ValueError):
+            ScoreGrid(1.2, 1.0, covariance=-0.1)
+
+    def test_covariance_keeps_the_grid_normalised(self):
+        grid = ScoreGrid(1.2, 1.0, covariance=0.3).grid
+        self.assertTrue(np.isclose(grid.sum(), 1.0))
+
+
+if __name__ == "__main__":
+    unittest.main()